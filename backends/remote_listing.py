@@ -0,0 +1,163 @@
+import os
+import time
+import json
+import calendar
+import logging
+import subprocess
+import threading
+from typing import Dict
+
+from media_index import get_media_index, is_media_file
+
+logger = logging.getLogger(__name__)
+
+# Written by scripts/rclone-sync.sh into its backend directory, contains "remote:path"
+REMOTE_FILE_NAME = '.rclone-remote'
+
+
+def parse_rclone_time(value: str) -> float:
+    """Convert an rclone lsjson ModTime (RFC 3339) into a timestamp, to the second."""
+    try:
+        return float(calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def remote_file_path(remote: str, name: str) -> str:
+    """Join a "remote:path" and a file name."""
+    if remote.endswith((':', '/')):
+        return f"{remote}{name}"
+    return f"{remote}/{name}"
+
+
+class RemoteListing:
+    """
+    Keeps the media index of cloud backends in line with their remote folders.
+
+    The remote folder of a backend is listed with `rclone lsjson` at most once
+    per TTL; stale listings are served while a background refresh runs.
+    Uploads finished by the sync service are added right away from its
+    "done" events, see handle_event().
+    """
+
+    def __init__(self, local_storage_dir: str, rclone_config_path: str = "/home/bot/rclone-config/rclone.conf",
+                 ttl: int = 300, timeout: int = 60):
+        self.local_storage_dir = local_storage_dir
+        self.rclone_config_path = rclone_config_path
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._refreshed_at = {}  # backend -> time of the last successful listing
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get_remote(self, backend: str) -> str:
+        """
+        Return the "remote:path" files of a backend are uploaded to, as announced
+        by its sync service, or from RCLONE_REMOTE_PATH if it did not announce one.
+        """
+        remote_file = os.path.join(self.local_storage_dir, backend, REMOTE_FILE_NAME)
+        try:
+            with open(remote_file, 'r') as f:
+                remote = f.read().strip()
+            if remote:
+                return remote
+        except IOError:
+            pass
+        return f"{backend}:{os.getenv('RCLONE_REMOTE_PATH', 'youtube-downloads')}"
+
+    def refresh(self, backend: str) -> bool:
+        """List the remote folder of a backend and reconcile the media index with it."""
+        remote = self.get_remote(backend)
+        started_at = time.time()
+        cmd = [
+            'rclone', 'lsjson', remote,
+            '--files-only',
+            '--config', self.rclone_config_path
+        ]
+
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout)
+            if result.returncode != 0:
+                logger.warning(f"Failed to list {remote}: {result.stderr}")
+                return False
+            listing = json.loads(result.stdout)
+        except subprocess.TimeoutExpired:
+            logger.error(f"Timeout listing {remote}")
+            return False
+        except (ValueError, OSError) as e:
+            logger.error(f"Error listing {remote}: {e}")
+            return False
+
+        entries = {}
+        for item in listing:
+            name = item.get('Name') or ''
+            if item.get('IsDir') or not is_media_file(name):
+                continue
+            entries[remote_file_path(remote, item.get('Path', name))] = (
+                name, int(item.get('Size') or 0), parse_rclone_time(item.get('ModTime'))
+            )
+
+        # Uploads announced while rclone was listing are kept
+        get_media_index().reconcile_entries(backend, entries, since=started_at)
+        with self._lock:
+            self._refreshed_at[backend] = time.time()
+        logger.info(f"Listed {len(entries)} media files in {remote} in {time.time() - started_at:.1f}s")
+        return True
+
+    def ensure_fresh(self, backend: str) -> None:
+        """
+        Make sure the media index holds a listing of the backend.
+        Only the first listing is waited for, later ones refresh in the background.
+        """
+        with self._lock:
+            refreshed_at = self._refreshed_at.get(backend)
+
+        if refreshed_at is None:
+            self.refresh(backend)
+        elif time.time() - refreshed_at >= self.ttl:
+            self._refresh_in_background(backend)
+
+    def _refresh_in_background(self, backend: str) -> None:
+        """Start a refresh of a backend unless one is already running."""
+        with self._lock:
+            if backend in self._refreshing:
+                return
+            self._refreshing.add(backend)
+
+        def refresh():
+            try:
+                self.refresh(backend)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(backend)
+
+        threading.Thread(target=refresh, name=f"remote-listing-{backend}", daemon=True).start()
+
+    def add_uploaded_file(self, backend: str, filename: str, size: int = 0, source_url: str = None,
+                          title: str = None, uploader: str = None) -> None:
+        """Add a file that was just uploaded to a backend to its listing."""
+        if not is_media_file(filename):
+            return
+        path = remote_file_path(self.get_remote(backend), filename)
+        get_media_index().upsert_entry(backend, path, filename, size, time.time(), source_url, title, uploader)
+        logger.debug(f"Added uploaded file {filename} to listing of {backend}")
+
+    def handle_event(self, event: Dict) -> None:
+        """Add files the sync service finished uploading, see LogTailer.add_listener()."""
+        if event['type'] == 'done' and event.get('backend'):
+            self.add_uploaded_file(event['backend'], event['filename'], int(event.get('size') or 0))
+
+
+# Global remote listing instance
+remote_listing = None
+
+def get_remote_listing() -> RemoteListing:
+    """Get or create the global remote listing, configured from the environment."""
+    global remote_listing
+    if remote_listing is None:
+        remote_listing = RemoteListing(
+            os.getenv('LOCAL_STORAGE_DIR', '/home/bot/data'),
+            ttl=int(os.getenv('REMOTE_LISTING_TTL', '300'))
+        )
+    return remote_listing
@@ -1,11 +1,19 @@
 import os
+import time
+import shutil
 import subprocess
 import logging
+import threading
 import configparser
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
+# Hidden directory inside each backend directory where downloads are assembled.
+# It lives on the same filesystem as the backend so finished files can be renamed
+# into place; the rclone sync sidecar and /ls only look at top-level files.
+STAGING_DIR_NAME = '.staging'
+
 class StorageManager:
     """Manages storage backends and routing based on available rclone remotes"""
     
@@ -14,6 +22,19 @@ class StorageManager:
         self.local_storage_dir = os.getenv('LOCAL_STORAGE_DIR', '/home/bot/data')
         self.default_backend = os.getenv('DEFAULT_STORAGE_BACKEND', None)
         
+        # Running rclone backends are cached so one message causes at most one heartbeat scan
+        self.backend_cache_ttl = float(os.getenv('BACKEND_CACHE_TTL', '5'))
+        self._running_backends = []
+        self._running_backends_checked_at = 0.0
+        self._backend_lock = threading.Lock()
+        
+        # Background watcher keeping the backend registry current, see start_watcher()
+        self._watcher_thread = None
+        self._listeners = []
+        
+        # Background removal of abandoned partial downloads, see start_staging_collector()
+        self._collector_thread = None
+        
     def get_available_backends(self) -> Dict[str, str]:
         """Get all available storage backends based on running containers"""
         backends = {"local": "Local Storage"}
@@ -26,10 +47,73 @@ class StorageManager:
         return backends
     
     def _get_running_rclone_backends(self) -> List[str]:
+        """
+        Get list of currently running rclone backends.
+        While the watcher is running this never touches the filesystem,
+        otherwise heartbeats are rescanned at most once per TTL.
+        """
+        with self._backend_lock:
+            if self._watcher_thread is not None:
+                return list(self._running_backends)
+            stale = time.time() - self._running_backends_checked_at >= self.backend_cache_ttl
+        
+        if stale:
+            return self.refresh_backends()
+        with self._backend_lock:
+            return list(self._running_backends)
+    
+    def refresh_backends(self) -> List[str]:
+        """Rescan heartbeat files immediately and return the running rclone backends"""
+        running_backends = self._scan_rclone_heartbeats()
+        with self._backend_lock:
+            previous = self._running_backends
+            self._running_backends = running_backends
+            self._running_backends_checked_at = time.time()
+            listeners = list(self._listeners)
+        
+        if running_backends != previous:
+            logger.info(f"Running rclone backends changed: {previous} -> {running_backends}")
+            for listener in listeners:
+                try:
+                    listener(list(running_backends))
+                except Exception as e:
+                    logger.error(f"Backend listener failed: {e}")
+        return list(running_backends)
+    
+    def add_listener(self, listener: Callable[[List[str]], None]) -> None:
+        """Register a callback invoked with the running rclone backends whenever they change"""
+        with self._backend_lock:
+            self._listeners.append(listener)
+    
+    def start_watcher(self, interval: float = None) -> None:
+        """
+        Register the running backends once and keep the registry current in a
+        background thread, so lookups on the message path never wait for a scan.
+        Heartbeats appearing or expiring are picked up within one interval.
+        """
+        if self._watcher_thread is not None:
+            return
+        if interval is None:
+            interval = float(os.getenv('BACKEND_WATCH_INTERVAL', '2'))
+        
+        self.refresh_backends()
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh_backends()
+                except Exception as e:
+                    logger.error(f"Error refreshing storage backends: {e}")
+        
+        with self._backend_lock:
+            self._watcher_thread = threading.Thread(target=watch, name="backend-watcher", daemon=True)
+            self._watcher_thread.start()
+        logger.info(f"Backend watcher started (interval {interval}s), running backends: {self._running_backends}")
+    
+    def _scan_rclone_heartbeats(self) -> List[str]:
         """Get list of currently running rclone backends by checking heartbeat files"""
         try:
-            import time
-            
             running_backends = []
             current_time = time.time()
             max_age = 30  # Heartbeat must be newer than 30 seconds
@@ -65,8 +149,8 @@ class StorageManager:
                     except (ValueError, IOError) as e:
                         logger.debug(f"Invalid heartbeat file for '{item}': {e}")
                         
-            logger.info(f"Found running rclone backends via heartbeat: {running_backends}")
-            return running_backends
+            logger.debug(f"Found running rclone backends via heartbeat: {running_backends}")
+            return sorted(running_backends)
             
         except Exception as e:
             logger.error(f"Error checking heartbeat files: {e}")
@@ -106,6 +190,64 @@ class StorageManager:
         os.makedirs(path, exist_ok=True)
         return path
     
+    def get_staging_path(self, backend: str) -> str:
+        """Get the staging directory for downloads into a given backend"""
+        return os.path.join(self.get_storage_path(backend), STAGING_DIR_NAME)
+    
+    def collect_abandoned_staging(self, max_age: float) -> int:
+        """
+        Remove staging directories nothing was written to for max_age seconds:
+        partial downloads of failed jobs that were not requested again.
+        Returns the number of removed directories.
+        """
+        removed = 0
+        now = time.time()
+        for backend in self.get_available_backends():
+            staging_path = self.get_staging_path(backend)
+            if not os.path.isdir(staging_path):
+                continue
+            for name in os.listdir(staging_path):
+                job_dir = os.path.join(staging_path, name)
+                if not os.path.isdir(job_dir):
+                    continue
+                try:
+                    last_write = max([os.path.getmtime(job_dir)] + [
+                        os.path.getmtime(os.path.join(job_dir, f)) for f in os.listdir(job_dir)
+                    ])
+                except OSError:
+                    # Removed or finished meanwhile
+                    continue
+                if now - last_write > max_age:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                    removed += 1
+                    logger.info(f"Removed abandoned partial download {job_dir}")
+        return removed
+    
+    def start_staging_collector(self, max_age: float = None, interval: float = 3600) -> None:
+        """
+        Remove abandoned partial downloads now and then every interval seconds in a background thread.
+        
+        Args:
+            max_age: Seconds after which a partial download is abandoned (default: STAGING_MAX_AGE_HOURS or 24 hours)
+            interval: Seconds between collections
+        """
+        if self._collector_thread is not None:
+            return
+        if max_age is None:
+            max_age = float(os.getenv('STAGING_MAX_AGE_HOURS') or 24) * 3600
+        
+        def collect():
+            while True:
+                try:
+                    self.collect_abandoned_staging(max_age)
+                except Exception as e:
+                    logger.error(f"Error removing abandoned partial downloads: {e}")
+                time.sleep(interval)
+        
+        self._collector_thread = threading.Thread(target=collect, name="staging-collector", daemon=True)
+        self._collector_thread.start()
+        logger.info(f"Staging collector started (partial downloads kept for {max_age / 3600:g}h)")
+    
     def get_default_backend(self) -> Optional[str]:
         """Get the default backend if configured and running"""
         if self.default_backend:
@@ -4,9 +4,13 @@ import logging
 import subprocess
 import shutil
 import json
+import threading
 from typing import Dict, Optional, Tuple
 import telegram
 
+from message_scheduler import get_message_scheduler
+from bot_client import get_bot
+
 logger = logging.getLogger(__name__)
 
 class StorageMonitor:
@@ -14,13 +18,19 @@ class StorageMonitor:
     Monitors cloud storage space and sends Telegram notifications when storage is low.
     """
     
-    def __init__(self, bot_token: str, rclone_config_path: str = "/home/bot/rclone-config/rclone.conf"):
-        self.bot = telegram.Bot(bot_token)
+    def __init__(self, bot: telegram.Bot, rclone_config_path: str = "/home/bot/rclone-config/rclone.conf"):
+        self.bot = bot
         self.rclone_config_path = rclone_config_path
         
         # Storage threshold (in bytes) - only one warning level
         self.warning_threshold = int(os.getenv('STORAGE_WARNING_THRESHOLD_GB', '1')) * 1024 * 1024 * 1024  # Default 1GB
         
+        # Cloud quota results are cached per backend and refreshed in the background
+        self.quota_cache_ttl = int(os.getenv('STORAGE_QUOTA_CACHE_TTL', '300'))
+        self._quota_cache = {}  # backend -> (timestamp, storage_info)
+        self._refreshing = set()
+        self._quota_lock = threading.Lock()
+        
         logger.info(f"Storage monitor initialized - Warning threshold: {self.warning_threshold / (1024**3):.1f}GB")
     
     def check_storage_space(self, backend: str) -> Optional[Dict[str, int]]:
@@ -74,6 +84,74 @@ class StorageMonitor:
             logger.error(f"Error checking storage for {backend}: {e}")
             return None
     
+    def get_cached_storage_space(self, backend: str, blocking: bool = True) -> Optional[Dict[str, int]]:
+        """
+        Get storage space for a cloud backend from the quota cache.
+        
+        Stale entries are returned as they are while a background refresh runs.
+        Without any cached entry the backend is checked synchronously if blocking,
+        otherwise a background refresh is started and None is returned.
+        
+        Args:
+            backend: Backend name
+            blocking: Wait for rclone if nothing is cached yet
+            
+        Returns:
+            Dict with 'total', 'used', 'free' in bytes, or None if unknown
+        """
+        with self._quota_lock:
+            entry = self._quota_cache.get(backend)
+        
+        if entry is None:
+            if blocking:
+                return self.refresh_storage_space(backend)
+            self._refresh_in_background(backend)
+            return None
+        
+        timestamp, storage_info = entry
+        if time.time() - timestamp >= self.quota_cache_ttl:
+            self._refresh_in_background(backend)
+        return dict(storage_info)
+    
+    def refresh_storage_space(self, backend: str) -> Optional[Dict[str, int]]:
+        """Query rclone for the storage space of a backend and update the cache."""
+        storage_info = self.check_storage_space(backend)
+        if storage_info:
+            with self._quota_lock:
+                self._quota_cache[backend] = (time.time(), storage_info)
+        return storage_info
+    
+    def _refresh_in_background(self, backend: str) -> None:
+        """Start a refresh of the quota cache unless one is already running for backend."""
+        with self._quota_lock:
+            if backend in self._refreshing:
+                return
+            self._refreshing.add(backend)
+        
+        def refresh():
+            try:
+                self.refresh_storage_space(backend)
+            finally:
+                with self._quota_lock:
+                    self._refreshing.discard(backend)
+        
+        threading.Thread(target=refresh, name=f"quota-refresh-{backend}", daemon=True).start()
+    
+    def record_usage(self, backend: str, size_bytes: int) -> None:
+        """
+        Account for a file just written to a cloud backend in the cached quota,
+        so back-to-back downloads see up-to-date free space without asking rclone.
+        """
+        with self._quota_lock:
+            entry = self._quota_cache.get(backend)
+            if entry is None:
+                return
+            timestamp, storage_info = entry
+            storage_info = dict(storage_info)
+            storage_info['used'] += size_bytes
+            storage_info['free'] = max(0, storage_info['free'] - size_bytes)
+            self._quota_cache[backend] = (timestamp, storage_info)
+    
     def check_local_filesystem_space(self, path: str) -> Optional[Dict[str, int]]:
         """
         Check local filesystem space for a given path.
@@ -109,7 +187,8 @@ class StorageMonitor:
             bytes_size /= 1024.0
         return f"{bytes_size:.1f} PB"
     
-    def check_and_notify(self, backend: str, chat_id: int, storage_path: str = None) -> bool:
+    def check_and_notify(self, backend: str, chat_id: int, storage_path: str = None,
+                         blocking: bool = True) -> bool:
         """
         Check storage space and send notification if needed.
         Always sends warning if storage is low (no tracking/throttling).
@@ -118,6 +197,7 @@ class StorageMonitor:
             backend: Backend name to check
             chat_id: Telegram chat ID to send notifications to
             storage_path: Local path for local backend
+            blocking: For cloud backends, wait for rclone if no quota is cached yet
             
         Returns:
             True if storage is sufficient, False if low
@@ -131,7 +211,7 @@ class StorageMonitor:
             storage_info = self.check_local_filesystem_space(storage_path)
         else:
             # Check cloud storage space
-            storage_info = self.check_storage_space(backend)
+            storage_info = self.get_cached_storage_space(backend, blocking=blocking)
         
         if not storage_info:
             logger.warning(f"Could not check storage for {backend}")
@@ -182,7 +262,8 @@ class StorageMonitor:
         )
         
         try:
-            self.bot.send_message(
+            get_message_scheduler().call(
+                chat_id, self.bot.send_message,
                 chat_id=chat_id,
                 text=message,
                 parse_mode='Markdown'
@@ -207,7 +288,7 @@ class StorageMonitor:
                 return None
             storage_info = self.check_local_filesystem_space(storage_path)
         else:
-            storage_info = self.check_storage_space(backend)
+            storage_info = self.get_cached_storage_space(backend)
         
         if not storage_info:
             return None
@@ -242,9 +323,9 @@ class StorageMonitor:
 # Global storage monitor instance
 storage_monitor = None
 
-def get_storage_monitor(bot_token: str) -> StorageMonitor:
-    """Get or create global storage monitor instance."""
+def get_storage_monitor(bot: telegram.Bot = None) -> StorageMonitor:
+    """Get or create global storage monitor instance using the shared bot client."""
     global storage_monitor
     if storage_monitor is None:
-        storage_monitor = StorageMonitor(bot_token)
+        storage_monitor = StorageMonitor(bot or get_bot())
     return storage_monitor 
\ No newline at end of file
@@ -3,19 +3,317 @@ import time
 import threading
 import logging
 import re
-from typing import Optional, Callable
+import json
+from collections import deque
+from typing import Dict, List, Optional, Callable
+
+from message_scheduler import get_message_scheduler
 
 logger = logging.getLogger(__name__)
 
+# Log file path (matches rclone container setup)
+DEFAULT_LOG_FILE = "/logs/rclone-upload.log"
+# JSON-lines upload events written by scripts/rclone-sync.sh
+DEFAULT_EVENT_FILE = "/logs/rclone-events.jsonl"
+
+# Terminal control sequences written by rclone --progress
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+UPLOAD_START_PATTERN = re.compile(r'📤 Uploading: (.+)$')
+UPLOAD_DONE_PATTERN = re.compile(r'Upload completed.*?: (.+)$')
+UPLOAD_FAILED_PATTERN = re.compile(r'❌ Upload failed for: (.+)$')
+# Per-file line of rclone --progress: " *   name.mp3: 45% /10.5Mi, 1.2Mi/s, 5s"
+FILE_PROGRESS_PATTERN = re.compile(
+    r'^\*\s+(.+?):\s*(\d+)%\s*/\s*([^,]+)(?:,\s*([^,]+))?(?:,\s*(\S+))?'
+)
+# Summary line of rclone --progress: "Transferred: 1.2M / 5.6M, 21%, 500 kB/s, ETA 30s"
+TRANSFERRED_PATTERN = re.compile(
+    r'Transferred:\s*([^,]+?)\s*/\s*([^,]+),\s*(\d+)%(?:,\s*([^,]+))?(?:,\s*ETA\s*([^,\s]+))?'
+)
+
+
+def parse_log_line(line: str, current_upload: Optional[str] = None) -> Optional[Dict]:
+    """
+    Parse one line of the rclone upload log into an event dict with at least
+    'type' ('start', 'progress', 'done' or 'failed') and 'filename'.
+    
+    Args:
+        line: Log line without trailing newline
+        current_upload: File currently uploading, used for summary lines without filename
+        
+    Returns:
+        Event dict, or None if the line carries no upload information
+    """
+    line = ANSI_ESCAPE_PATTERN.sub('', line).strip()
+    if not line:
+        return None
+    
+    match = UPLOAD_START_PATTERN.search(line)
+    if match:
+        return {'type': 'start', 'filename': match.group(1).strip()}
+    
+    match = UPLOAD_FAILED_PATTERN.search(line)
+    if match:
+        return {'type': 'failed', 'filename': match.group(1).strip()}
+    
+    match = UPLOAD_DONE_PATTERN.search(line)
+    if match:
+        return {'type': 'done', 'filename': match.group(1).strip()}
+    
+    match = FILE_PROGRESS_PATTERN.search(line)
+    if match:
+        return {
+            'type': 'progress',
+            'filename': match.group(1).strip(),
+            'percent': int(match.group(2)),
+            'transferred': None,
+            'total': match.group(3).strip(),
+            'speed': match.group(4).strip() if match.group(4) else None,
+            'eta': match.group(5).strip() if match.group(5) else None
+        }
+    
+    match = TRANSFERRED_PATTERN.search(line)
+    # Skip the file count line ("Transferred: 0 / 1, 0%"), only byte totals carry units
+    if match and current_upload and re.search(r'[A-Za-z]', match.group(2)):
+        return {
+            'type': 'progress',
+            'filename': current_upload,
+            'percent': int(match.group(3)),
+            'transferred': match.group(1).strip(),
+            'total': match.group(2).strip(),
+            'speed': match.group(4).strip() if match.group(4) else None,
+            'eta': match.group(5).strip() if match.group(5) else None
+        }
+    
+    return None
+
+
+def _format_size(bytes_size: float) -> str:
+    """Format bytes to human readable format."""
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} PiB"
+
+
+def parse_event_line(line: str, current_upload: Optional[str] = None) -> Optional[Dict]:
+    """
+    Parse one line of the JSON-lines event file written by rclone-sync.sh into
+    the same event dicts as parse_log_line(), plus 'job', 'backend' and 'size'.
+    
+    Args:
+        line: One JSON object
+        current_upload: Unused, events always name their file
+        
+    Returns:
+        Event dict, or None for unknown or malformed lines
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    
+    event_type = record.get('event')
+    filename = record.get('file')
+    if event_type not in ('start', 'progress', 'done', 'failed') or not filename:
+        return None
+    
+    event = {
+        'type': event_type,
+        'filename': filename,
+        'job': record.get('job'),
+        'backend': record.get('backend'),
+        'size': record.get('size')
+    }
+    
+    if event_type == 'progress':
+        # Stats block of rclone --use-json-log
+        stats = (record.get('rclone') or {}).get('stats') or {}
+        transferred = stats.get('bytes') or 0
+        total = stats.get('totalBytes') or 0
+        speed = stats.get('speed')
+        eta = stats.get('eta')
+        event.update({
+            'percent': int(transferred * 100 / total) if total else 0,
+            'transferred': _format_size(transferred),
+            'total': _format_size(total),
+            'speed': f"{_format_size(speed)}/s" if speed else None,
+            'eta': f"{eta}s" if eta is not None else None
+        })
+    
+    return event
+
+
+class LogTailer:
+    """
+    Follows one rclone upload log file in a single thread, parses every new line
+    once and dispatches the resulting events to the trackers subscribed to that
+    filename. Also enforces the monitoring timeouts of its trackers.
+    """
+    
+    # Events kept for trackers that subscribe shortly after their upload started
+    RECENT_EVENTS = 1000
+    REPLAY_WINDOW = 10
+    
+    def __init__(self, log_file: str, parser: Callable = parse_log_line, poll_interval: float = 1.0):
+        self.log_file = log_file
+        self.parser = parser
+        self.poll_interval = poll_interval
+        
+        self._subscribers = {}  # filename -> list of trackers
+        self._listeners = []  # callbacks receiving the events of all files
+        self._recent_events = deque(maxlen=self.RECENT_EVENTS)  # (received_at, event)
+        self._current_upload = None
+        self._position = None
+        self._lock = threading.Lock()
+        self._thread = None
+        
+    def start(self) -> None:
+        """Start following the log file (idempotent). Reading starts at its current end."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            if os.path.exists(self.log_file):
+                self._position = os.path.getsize(self.log_file)
+            self._thread = threading.Thread(
+                target=self._run, name=f"log-tailer-{os.path.basename(self.log_file)}", daemon=True
+            )
+            self._thread.start()
+        logger.info(f"Tailing upload log file: {self.log_file}")
+        
+    def subscribe(self, filename: str, tracker) -> None:
+        """
+        Deliver events for filename to tracker.handle_event(). Events received
+        shortly before subscribing are replayed, since monitoring starts after
+        the file was handed to the sync service.
+        """
+        self.start()
+        with self._lock:
+            self._subscribers.setdefault(filename, []).append(tracker)
+            since = tracker.started_at - self.REPLAY_WINDOW
+            replay = [event for received_at, event in self._recent_events
+                      if received_at >= since and event['filename'] == filename]
+        
+        for event in replay:
+            if self._deliver(tracker, event):
+                break
+            
+    def add_listener(self, listener: Callable[[Dict], None]) -> None:
+        """Register a callback invoked with every new event, whatever file it is about."""
+        with self._lock:
+            self._listeners.append(listener)
+            
+    def unsubscribe(self, filename: str, tracker) -> None:
+        with self._lock:
+            trackers = self._subscribers.get(filename, [])
+            if tracker in trackers:
+                trackers.remove(tracker)
+            if not trackers:
+                self._subscribers.pop(filename, None)
+                
+    def _deliver(self, tracker, event: Dict) -> bool:
+        """Pass event to tracker, unsubscribing it once it is finished."""
+        try:
+            finished = tracker.handle_event(event)
+        except Exception as e:
+            logger.error(f"Error handling upload event: {e}")
+            finished = False
+        if finished:
+            self.unsubscribe(event['filename'], tracker)
+        return finished
+    
+    def _dispatch(self, event: Dict) -> None:
+        with self._lock:
+            self._recent_events.append((time.time(), event))
+            trackers = list(self._subscribers.get(event['filename'], []))
+            listeners = list(self._listeners)
+        for tracker in trackers:
+            self._deliver(tracker, event)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"Upload event listener failed: {e}")
+            
+    def _read_new_lines(self) -> List[str]:
+        if not os.path.exists(self.log_file):
+            return []
+        
+        size = os.path.getsize(self.log_file)
+        if self._position is None or size < self._position:
+            # First appearance or truncated/rotated log
+            self._position = 0
+        if size == self._position:
+            return []
+        
+        with open(self.log_file, 'rb') as f:
+            f.seek(self._position)
+            data = f.read()
+            
+        # Keep an incomplete last line for the next round
+        last_newline = data.rfind(b'\n')
+        if last_newline < 0:
+            return []
+        self._position += last_newline + 1
+        text = data[:last_newline].decode('utf-8', errors='replace')
+        # rclone --progress redraws its output with carriage returns
+        return text.replace('\r', '\n').split('\n')
+    
+    def _check_timeouts(self) -> None:
+        now = time.time()
+        log_exists = os.path.exists(self.log_file)
+        with self._lock:
+            trackers = [(filename, tracker) for filename, trackers in self._subscribers.items()
+                        for tracker in trackers]
+        for filename, tracker in trackers:
+            if tracker.check_timeout(now, log_exists):
+                self.unsubscribe(filename, tracker)
+                
+    def _run(self) -> None:
+        while True:
+            try:
+                for line in self._read_new_lines():
+                    event = self.parser(line, self._current_upload)
+                    if event is None:
+                        continue
+                    if event['type'] == 'start':
+                        self._current_upload = event['filename']
+                    elif event['type'] in ('done', 'failed') and event['filename'] == self._current_upload:
+                        self._current_upload = None
+                    self._dispatch(event)
+                self._check_timeouts()
+            except Exception as e:
+                logger.error(f"Error tailing upload log {self.log_file}: {e}")
+            time.sleep(self.poll_interval)
+
+
+# One tailer per log file
+_log_tailers = {}
+_log_tailers_lock = threading.Lock()
+
+def get_log_tailer(log_file: str = DEFAULT_LOG_FILE) -> LogTailer:
+    """Get or create the shared tailer for a log file (.jsonl files are parsed as events)."""
+    with _log_tailers_lock:
+        if log_file not in _log_tailers:
+            parser = parse_event_line if log_file.endswith('.jsonl') else parse_log_line
+            _log_tailers[log_file] = LogTailer(log_file, parser)
+        return _log_tailers[log_file]
+
+
 class UploadProgressTracker:
     """
-    Tracks upload progress for cloud storage backends by monitoring rclone logs
-    and provides real-time updates to Telegram messages.
+    Tracks upload progress for cloud storage backends from the events of the
+    shared rclone log tailer and provides real-time updates to Telegram messages.
     """
     
+    # Seconds to wait for the log file to appear before giving up
+    LOG_FILE_TIMEOUT = 30
+    
     def __init__(self, bot, chat_id: int, message_id: int, backend: str, filename: str,
                  original_user_message_id: int = None, file_path: str = None, 
-                 output_format: str = None, url: str = None, backend_name: str = None):
+                 output_format: str = None, url: str = None, backend_name: str = None,
+                 on_success: Optional[Callable[[], None]] = None,
+                 on_message: Optional[Callable[..., None]] = None):
         self.bot = bot
         self.chat_id = chat_id
         self.message_id = message_id
@@ -29,22 +327,33 @@ class UploadProgressTracker:
         self.url = url
         self.backend_name = backend_name or backend
         
+        # Called once the upload completed successfully
+        self.on_success = on_success
+        # Called with every text (and edit options) written to the progress message,
+        # e.g. to mirror it to the messages of attached requests
+        self.on_message = on_message
+        
         # Progress tracking
         self.is_monitoring = False
         self.last_percent = 0
         self.last_update_time = 0
         self.upload_started = False
         self.upload_completed = False
+        self.started_at = time.time()
+        self.deadline = None
+        # Id the sync service assigned to this upload, taken from the first event
+        self.job_id = None
         
-        # Log file path (matches rclone container setup)
-        self.log_file = "/logs/rclone-upload.log"
-        
-        # Thread for monitoring
-        self.monitor_thread = None
+        # Prefer the structured event file, fall back to parsing the human-readable log
+        # of sync services that do not write events yet
+        if os.path.exists(DEFAULT_EVENT_FILE):
+            self.log_file = DEFAULT_EVENT_FILE
+        else:
+            self.log_file = DEFAULT_LOG_FILE
         
     def start_monitoring(self, timeout: int = 300) -> None:
         """
-        Start monitoring upload progress in a separate thread.
+        Start receiving upload events from the shared log tailer.
         
         Args:
             timeout: Maximum time to wait for upload completion (seconds)
@@ -54,127 +363,96 @@ class UploadProgressTracker:
             return
             
         self.is_monitoring = True
-        self.monitor_thread = threading.Thread(
-            target=self._monitor_upload_progress,
-            args=(timeout,),
-            daemon=True
-        )
-        self.monitor_thread.start()
+        self.started_at = time.time()
+        self.deadline = self.started_at + timeout
+        get_log_tailer(self.log_file).subscribe(self.filename, self)
         logger.info(f"Started upload progress monitoring for {self.filename}")
         
     def stop_monitoring(self) -> None:
         """Stop monitoring upload progress."""
         self.is_monitoring = False
-        if self.monitor_thread and self.monitor_thread.is_alive():
-            self.monitor_thread.join(timeout=2)
+        get_log_tailer(self.log_file).unsubscribe(self.filename, self)
         logger.info(f"Stopped upload progress monitoring for {self.filename}")
         
-    def _monitor_upload_progress(self, timeout: int) -> None:
+    def check_timeout(self, now: float, log_exists: bool) -> bool:
         """
-        Monitor rclone log file for upload progress of the specific file.
+        Called periodically by the log tailer.
         
-        Args:
-            timeout: Maximum time to wait for upload completion
+        Returns:
+            True if monitoring ended because of a timeout
         """
-        start_time = time.time()
-        last_log_position = 0
+        if not self.is_monitoring or self.upload_completed:
+            return True
         
-        # Wait for log file to exist
-        while not os.path.exists(self.log_file) and self.is_monitoring:
-            if time.time() - start_time > 30:  # 30 second timeout for log file
-                logger.warning(f"Log file {self.log_file} not found after 30 seconds")
-                self._update_message("⚠️ Upload monitoring unavailable")
-                return
-            time.sleep(1)
-            
-        logger.info(f"Monitoring log file: {self.log_file}")
+        if not log_exists and now - self.started_at > self.LOG_FILE_TIMEOUT:
+            logger.warning(f"Log file {self.log_file} not found after {self.LOG_FILE_TIMEOUT} seconds")
+            self.is_monitoring = False
+            self._update_message("⚠️ Upload monitoring unavailable")
+            return True
         
-        while self.is_monitoring and (time.time() - start_time) < timeout:
-            try:
-                if os.path.exists(self.log_file):
-                    with open(self.log_file, 'r') as f:
-                        # Seek to last position to only read new lines
-                        f.seek(last_log_position)
-                        new_lines = f.readlines()
-                        last_log_position = f.tell()
-                        
-                        # Process new log lines
-                        for line in new_lines:
-                            if self._process_log_line(line.strip()):
-                                # Upload completed
-                                return
-                                
-                time.sleep(1)  # Check every second
-                
-            except Exception as e:
-                logger.error(f"Error monitoring upload progress: {e}")
-                time.sleep(2)
-                
-        # Timeout reached
-        if self.is_monitoring and not self.upload_completed:
+        if self.deadline and now > self.deadline:
             logger.warning(f"Upload monitoring timeout for {self.filename}")
+            self.is_monitoring = False
             self._update_message("⏰ Upload monitoring timeout")
+            return True
+        
+        return False
             
-    def _process_log_line(self, line: str) -> bool:
+    def handle_event(self, event: Dict) -> bool:
         """
-        Process a single log line and extract upload progress.
+        Process an upload event for this file.
         
         Args:
-            line: Log line to process
+            event: Event dict produced by parse_log_line()
             
         Returns:
             True if upload completed, False otherwise
         """
-        if not line or self.filename not in line:
+        if not self.is_monitoring or self.upload_completed:
+            return True
+        
+        # Structured events name their backend and upload job, ignore other uploads
+        if event.get('backend') and event['backend'] != self.backend:
             return False
+        if event.get('job'):
+            if self.job_id is None:
+                self.job_id = event['job']
+            elif event['job'] != self.job_id:
+                return False
             
         try:
-            # Check for upload start
-            if "📤 Uploading:" in line and self.filename in line:
+            if event['type'] == 'start':
                 if not self.upload_started:
                     self.upload_started = True
                     self._update_message("☁️ Starting upload to cloud storage...")
                     logger.info(f"Upload started for {self.filename}")
                 return False
                 
-            # Check for upload completion
-            if "✅ Upload completed" in line and self.filename in line:
+            if event['type'] == 'done':
                 self.upload_completed = True
                 self._create_final_success_message()
                 logger.info(f"Upload completed for {self.filename}")
+                if self.on_success:
+                    self.on_success()
                 return True
                 
-            # Check for upload failure
-            if "❌ Upload failed" in line and self.filename in line:
+            if event['type'] == 'failed':
                 self.upload_completed = True
                 self._create_final_failure_message()
                 logger.error(f"Upload failed for {self.filename}")
                 return True
                 
-            # Parse rclone progress output
-            # Look for patterns like "Transferred: 1.2M / 5.6M, 21%"
-            progress_match = re.search(r'Transferred:.*?(\d+)%', line)
-            if progress_match:
-                percent = int(progress_match.group(1))
-                self._update_progress(percent)
-                
-            # Look for transfer rate and ETA
-            # Pattern: "Transferred: 1.2M / 5.6M, 21%, 500 kB/s, ETA 30s"
-            detailed_match = re.search(
-                r'Transferred:\s*([^,]+)\s*/\s*([^,]+),\s*(\d+)%(?:,\s*([^,]+))?(?:,\s*ETA\s*([^,\s]+))?',
-                line
-            )
-            if detailed_match:
-                transferred = detailed_match.group(1).strip()
-                total = detailed_match.group(2).strip()
-                percent = int(detailed_match.group(3))
-                speed = detailed_match.group(4).strip() if detailed_match.group(4) else None
-                eta = detailed_match.group(5).strip() if detailed_match.group(5) else None
-                
-                self._update_detailed_progress(percent, transferred, total, speed, eta)
+            if event['type'] == 'progress':
+                if event.get('transferred'):
+                    self._update_detailed_progress(
+                        event['percent'], event['transferred'], event['total'],
+                        event.get('speed'), event.get('eta')
+                    )
+                else:
+                    self._update_progress(event['percent'])
                 
         except Exception as e:
-            logger.error(f"Error processing log line: {e}")
+            logger.error(f"Error processing upload event: {e}")
             
         return False
         
@@ -208,16 +486,15 @@ class UploadProgressTracker:
             self.last_percent = percent
             self.last_update_time = current_time
             
-    def _update_message(self, text: str) -> None:
+    def _update_message(self, text: str, **kwargs) -> None:
         """Update the Telegram message with new text."""
-        try:
-            self.bot.edit_message_text(
-                text=text,
-                chat_id=self.chat_id,
-                message_id=self.message_id
-            )
-        except Exception as e:
-            logger.warning(f"Failed to update upload progress message: {e}")
+        if self.message_id is not None:
+            get_message_scheduler().edit(self.bot, self.chat_id, self.message_id, text, **kwargs)
+        if self.on_message:
+            try:
+                self.on_message(text, **kwargs)
+            except Exception as e:
+                logger.warning(f"Error mirroring upload message: {e}")
     
     def _create_final_success_message(self) -> None:
         """Create a comprehensive final success message and clean up original message."""
@@ -241,18 +518,13 @@ class UploadProgressTracker:
                 message += f"🔗 URL: {self.url[:50]}..."
             
             # Update the progress message with final status
-            self.bot.edit_message_text(
-                text=message,
-                chat_id=self.chat_id,
-                message_id=self.message_id,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
+            self._update_message(message, parse_mode='Markdown', disable_web_page_preview=True)
             
             # Delete the original user message with the YouTube URL
             if self.original_user_message_id and self.original_user_message_id != self.message_id:
                 try:
-                    self.bot.delete_message(self.chat_id, self.original_user_message_id)
+                    get_message_scheduler().call(self.chat_id, self.bot.delete_message,
+                                                 self.chat_id, self.original_user_message_id)
                     logger.info(f"Deleted original user message: {self.original_user_message_id}")
                 except Exception as e:
                     logger.warning(f"Could not delete original user message: {e}")
@@ -275,18 +547,13 @@ class UploadProgressTracker:
                 message += f"\n🔗 URL: {self.url[:50]}..."
             
             # Update the progress message with failure status
-            self.bot.edit_message_text(
-                text=message,
-                chat_id=self.chat_id,
-                message_id=self.message_id,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
+            self._update_message(message, parse_mode='Markdown', disable_web_page_preview=True)
             
             # Delete the original user message with the YouTube URL
             if self.original_user_message_id and self.original_user_message_id != self.message_id:
                 try:
-                    self.bot.delete_message(self.chat_id, self.original_user_message_id)
+                    get_message_scheduler().call(self.chat_id, self.bot.delete_message,
+                                                 self.chat_id, self.original_user_message_id)
                     logger.info(f"Deleted original user message: {self.original_user_message_id}")
                 except Exception as e:
                     logger.warning(f"Could not delete original user message: {e}")
@@ -310,14 +577,16 @@ class UploadProgressManager:
                               backend: str, filename: str, timeout: int = 300,
                               original_user_message_id: int = None, file_path: str = None,
                               output_format: str = None, url: str = None, 
-                              backend_name: str = None) -> UploadProgressTracker:
+                              backend_name: str = None,
+                              on_success: Optional[Callable[[], None]] = None,
+                              on_message: Optional[Callable[..., None]] = None) -> UploadProgressTracker:
         """
         Start monitoring upload progress for a file.
         
         Args:
             bot: Telegram bot instance
             chat_id: Chat ID for progress updates
-            message_id: Message ID to update
+            message_id: Message ID to update, None to only track the upload
             backend: Storage backend name
             filename: Name of file being uploaded
             timeout: Maximum monitoring time in seconds
@@ -326,12 +595,14 @@ class UploadProgressManager:
             output_format: Output format (mp3, mp4)
             url: Original YouTube URL
             backend_name: Display name of the backend
+            on_success: Callback invoked once the upload completed successfully
+            on_message: Callback invoked with every text written to the progress message
             
         Returns:
             UploadProgressTracker instance
         """
         # Stop any existing tracker for this file
-        tracker_key = f"{chat_id}_{message_id}"
+        tracker_key = f"{chat_id}_{message_id}_{filename}"
         if tracker_key in self.active_trackers:
             self.active_trackers[tracker_key].stop_monitoring()
             
@@ -342,7 +613,9 @@ class UploadProgressManager:
             file_path=file_path,
             output_format=output_format,
             url=url,
-            backend_name=backend_name
+            backend_name=backend_name,
+            on_success=on_success,
+            on_message=on_message
         )
         self.active_trackers[tracker_key] = tracker
         tracker.start_monitoring(timeout)
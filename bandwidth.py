@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+import logging
+from typing import Dict, Hashable, Optional
+
+from yt_dlp.utils import parse_bytes
+
+logger = logging.getLogger(__name__)
+
+UNLIMITED = float('inf')
+
+# A download using less than this part of its share is limited by its source, not by its share
+SATURATION = 0.8
+# Room a source-limited download gets above its measured speed to speed up again
+HEADROOM = 1.25
+# Seconds between rebalances triggered by download progress
+REBALANCE_INTERVAL = 1.0
+# Seconds after which an upload without events no longer counts as active
+UPLOAD_IDLE_TIMEOUT = 60
+# Seconds of its share a download may burst after being idle
+BURST_SECONDS = 1.0
+# Longest single wait of a throttled download, so changed shares apply quickly
+MAX_WAIT = 1.0
+
+
+def max_min_share(capacity: float, demands: Dict[Hashable, float]) -> Dict[Hashable, float]:
+    """
+    Split capacity max-min fair: nobody gets more than it demands, and what
+    the modest demands leave over is split equally among the others.
+    """
+    if capacity == UNLIMITED:
+        return dict(demands)
+
+    shares = {}
+    remaining = capacity
+    pending = sorted(demands.items(), key=lambda item: item[1])
+    while pending:
+        fair_share = remaining / len(pending)
+        key, demand = pending[0]
+        if demand > fair_share:
+            for key, _ in pending:
+                shares[key] = fair_share
+            break
+        shares[key] = demand
+        remaining -= demand
+        pending.pop(0)
+    return shares
+
+
+class BandwidthManager:
+    """
+    Shares the download bandwidth between running downloads.
+
+    The total limit is split max-min fair between users and then between the
+    downloads of each user, so one large download cannot starve the others and
+    small downloads finish quickly. Users and single downloads can be capped,
+    and while the sync service uploads, a share of the total is kept free for it.
+
+    Downloads that do not use their share (slow sources) are given their
+    measured speed plus some headroom, the rest goes to the others. Each
+    download spends its share from a token bucket in its progress hook, see
+    throttle(); external downloaders only get their share at start, see get_rate().
+    """
+
+    def __init__(self, total_limit: float = None, user_limit: float = None, job_limit: float = None,
+                 upload_share: float = 0.2):
+        self.total_limit = total_limit or UNLIMITED
+        self.user_limit = user_limit or UNLIMITED
+        self.job_limit = job_limit or UNLIMITED
+        self.upload_share = min(max(upload_share, 0.0), 0.9)
+
+        # job -> {'user': user id, 'speed': measured bytes/s, 'rate': allocated bytes/s,
+        #         'tokens': bytes it may download now, 'bytes': {file: downloaded bytes}, 'refilled_at': time}
+        self._jobs = {}
+        self._uploads = {}  # (sync job, file) -> time of its last upload event
+        self._rebalanced_at = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, job: Hashable, user_id: Optional[int] = None) -> None:
+        """Add a download that is about to start."""
+        with self._lock:
+            self._jobs[job] = {'user': user_id, 'speed': None, 'rate': UNLIMITED,
+                               'tokens': 0.0, 'bytes': {}, 'refilled_at': time.time()}
+            self._rebalance()
+
+    def unregister(self, job: Hashable) -> None:
+        """Remove a finished download, its share goes to the others."""
+        with self._lock:
+            if self._jobs.pop(job, None) is not None:
+                self._rebalance()
+
+    def throttle(self, job: Hashable, downloaded_bytes: Optional[int], speed: Optional[float] = None,
+                 filename: Optional[str] = None) -> None:
+        """
+        Account the progress of a download and wait while it is ahead of its share.
+        Called from the yt-dlp progress hook with the downloaded bytes so far of the
+        file being downloaded (e.g. the video, then the audio stream) and the
+        measured speed in bytes/s.
+        """
+        with self._lock:
+            entry = self._jobs.get(job)
+            if entry is None or downloaded_bytes is None:
+                return
+            now = time.time()
+            entry['speed'] = speed
+            if now - self._rebalanced_at >= REBALANCE_INTERVAL:
+                self._rebalance()
+
+            # Fewer bytes than before means the file started over as a new stream
+            previous = entry['bytes'].get(filename, 0)
+            received = downloaded_bytes - previous if downloaded_bytes >= previous else downloaded_bytes
+            entry['bytes'][filename] = downloaded_bytes
+            rate = entry['rate']
+            if rate == UNLIMITED:
+                entry['refilled_at'] = now
+                return
+            entry['tokens'] = min(rate * BURST_SECONDS,
+                                  entry['tokens'] + rate * (now - entry['refilled_at'])) - received
+            entry['refilled_at'] = now
+            wait = -entry['tokens'] / rate if rate > 0 else MAX_WAIT
+
+        if wait > 0:
+            time.sleep(min(wait, MAX_WAIT))
+
+    def get_rate(self, job: Hashable) -> Optional[float]:
+        """Return the bytes/s a download may use, None if it is not limited."""
+        with self._lock:
+            entry = self._jobs.get(job)
+            if entry is None or entry['rate'] == UNLIMITED:
+                return None
+            return entry['rate']
+
+    def handle_event(self, event: Dict) -> None:
+        """Track running uploads of the sync service, see LogTailer.add_listener()."""
+        key = (event.get('job'), event['filename'])
+        with self._lock:
+            if event['type'] in ('start', 'progress'):
+                active = key in self._uploads
+                self._uploads[key] = time.time()
+                if not active:
+                    self._rebalance()
+            elif event['type'] in ('done', 'failed'):
+                if self._uploads.pop(key, None) is not None:
+                    self._rebalance()
+
+    def stats(self) -> Dict:
+        """Return the current allocation."""
+        with self._lock:
+            return {
+                'downloads': len(self._jobs),
+                'uploads': len(self._uploads),
+                'capacity': self._download_capacity(),
+                'allocated': {job: entry['rate'] for job, entry in self._jobs.items()}
+            }
+
+    def _download_capacity(self) -> float:
+        """Bandwidth available to downloads. Must be called with the lock held."""
+        now = time.time()
+        for key, seen_at in list(self._uploads.items()):
+            if now - seen_at > UPLOAD_IDLE_TIMEOUT:
+                del self._uploads[key]
+        if self._uploads and self.total_limit != UNLIMITED:
+            return self.total_limit * (1 - self.upload_share)
+        return self.total_limit
+
+    def _demand(self, entry: Dict) -> float:
+        """Bandwidth a download could use. Must be called with the lock held."""
+        speed, rate = entry['speed'], entry['rate']
+        if speed and rate != UNLIMITED and speed < rate * SATURATION:
+            # Limited by its source, not by its share
+            return min(self.job_limit, speed * HEADROOM)
+        return self.job_limit
+
+    def _rebalance(self) -> None:
+        """Recompute the shares of all downloads. Must be called with the lock held."""
+        self._rebalanced_at = time.time()
+        demands_by_user = {}
+        for job, entry in self._jobs.items():
+            demands_by_user.setdefault(entry['user'], {})[job] = self._demand(entry)
+
+        user_shares = max_min_share(self._download_capacity(), {
+            user: min(self.user_limit, sum(demands.values()))
+            for user, demands in demands_by_user.items()
+        })
+        for user, demands in demands_by_user.items():
+            for job, rate in max_min_share(user_shares[user], demands).items():
+                self._jobs[job]['rate'] = rate
+
+
+# Global bandwidth manager instance
+bandwidth_manager = None
+
+def get_bandwidth_manager() -> BandwidthManager:
+    """Get or create the global bandwidth manager, configured from the environment."""
+    global bandwidth_manager
+    if bandwidth_manager is None:
+        bandwidth_manager = BandwidthManager(
+            total_limit=parse_bytes(os.getenv('BANDWIDTH_LIMIT') or '0'),
+            user_limit=parse_bytes(os.getenv('USER_BANDWIDTH_LIMIT') or '0'),
+            job_limit=parse_bytes(os.getenv('JOB_BANDWIDTH_LIMIT') or '0'),
+            upload_share=float(os.getenv('UPLOAD_BANDWIDTH_SHARE') or '0.2')
+        )
+    return bandwidth_manager
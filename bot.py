@@ -9,15 +9,28 @@ Optimized Dockerfile for better layer caching.
 """
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackQueryHandler, ConversationHandler, CommandHandler, Filters, MessageHandler, Updater
+from telegram.ext import CallbackQueryHandler, ConversationHandler, CommandHandler, Filters, MessageHandler
 import logging
 import os
-import yt_dlp
+import re
+import threading
+from collections import OrderedDict
 from hurry.filesize import size
-from task import TaskData, DownloadTask
+from task import TaskData, DownloadTask, queue_batch_items, MAX_PLAYLIST_ITEMS
+from download_batch import DownloadBatch
+from transcoder import get_transcoder
 from backends.storage_manager import StorageManager
 from backends.storage_monitor import get_storage_monitor
-import subprocess
+from backends.upload_progress import get_log_tailer, DEFAULT_EVENT_FILE, DEFAULT_LOG_FILE
+from download_queue import get_download_queue, QueueFullError
+from job_store import get_job_store, STATUS_DONE, STATUS_FAILED, UNFINISHED_STATUSES
+from download_registry import inflight_registry
+from metadata_cache import get_metadata_cache
+from message_scheduler import get_message_scheduler
+from bot_client import create_updater, get_bot
+from media_index import get_media_index, MEDIA_EXTENSIONS
+from backends.remote_listing import get_remote_listing
+from bandwidth import get_bandwidth_manager
 
 # Enable logging
 logging.basicConfig(
@@ -49,8 +62,8 @@ if TRUSTED_USER_IDS is [] or TRUSTED_USER_IDS == [""]:
 DEFAULT_OUTPUT_FORMAT = os.getenv('DEFAULT_OUTPUT_FORMAT', '').lower()
 if DEFAULT_OUTPUT_FORMAT:
     logger.info(f"DEFAULT_OUTPUT_FORMAT is set to: {DEFAULT_OUTPUT_FORMAT}")
-    if DEFAULT_OUTPUT_FORMAT not in ['mp3', 'mp4']:
-        logger.warning(f"Invalid DEFAULT_OUTPUT_FORMAT '{DEFAULT_OUTPUT_FORMAT}', must be 'mp3' or 'mp4'. Ignoring.")
+    if DEFAULT_OUTPUT_FORMAT not in ['mp3', 'mp4', 'audio']:
+        logger.warning(f"Invalid DEFAULT_OUTPUT_FORMAT '{DEFAULT_OUTPUT_FORMAT}', must be 'mp3', 'mp4' or 'audio'. Ignoring.")
         DEFAULT_OUTPUT_FORMAT = ''
 
 # Stages - added STORAGE stage for backend selection
@@ -59,11 +72,32 @@ STORAGE, OUTPUT, DOWNLOAD = range(3)
 # Callback data
 CALLBACK_MP4 = "mp4"
 CALLBACK_MP3 = "mp3"
+# Original audio stream (m4a/opus/...) without re-encoding, see format_planner.py
+CALLBACK_AUDIO = "audio"
 CALLBACK_LOCAL = "local"
 CALLBACK_BEST_FORMAT = "best"
 CALLBACK_SELECT_FORMAT = "select_format"
 CALLBACK_ABORT = "abort"
 
+# Files shown on one page of /ls or /search results
+LIST_PAGE_SIZE = 20
+# Longer file names are shortened in listings
+MAX_LISTED_NAME_LENGTH = 80
+
+# Listings shown with page buttons, see register_listing()
+MAX_LISTING_CURSORS = 500
+listing_cursors = OrderedDict()
+listing_cursor_counter = 0
+# Handlers run on several dispatcher workers
+listing_cursors_lock = threading.Lock()
+
+# Links in messages and link lists; punctuation around a link is stripped by extract_urls()
+URL_PATTERN = re.compile(r'https?://[^\s<>"]+')
+# Largest link list document that is read, in bytes
+MAX_LINK_LIST_SIZE = 1024 * 1024
+# Rejected links listed when a batch is started
+MAX_LISTED_REJECTED_LINKS = 10
+
 # Initialize storage manager
 storage_manager = StorageManager()
 
@@ -95,6 +129,12 @@ def quick_url_check(url):
     return True, None
 
 
+def extract_urls(text):
+    """Return the distinct links in text in order of appearance."""
+    urls = (match.rstrip('.,;:!?)]}\'') for match in URL_PATTERN.findall(text or ''))
+    return list(dict.fromkeys(url for url in urls if url))
+
+
 
 def is_trusted(user_id):
     # convert to string if necessary
@@ -171,6 +211,7 @@ def help_command(update, context):
 
 **📥 How to use:**
 1. Send any YouTube URL to download
+   (several links or a .txt file of links are downloaded as one batch)
 2. Use `/ls` to see your files
 3. Use `/search music` to find specific files
 
@@ -200,78 +241,14 @@ def sanitize_search_query(query):
     return safe_query.strip()
 
 
-def get_media_files_from_gdrive():
-    """
-    Get all media files from Google Drive using rclone.
-    Returns list of file info dictionaries.
-    """
-    try:
-        # Use rclone directly instead of docker run
-        # The rclone config should be mounted at /home/bot/rclone-config/rclone.conf
-        cmd = [
-            'rclone', 'ls', 'gdrive:youtube-downloads',
-            '--config', '/home/bot/rclone-config/rclone.conf'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode != 0:
-            logger.warning(f"Failed to list Google Drive files: {result.stderr}")
-            return []
-        
-        # Parse rclone ls output
-        # Format: "    12345 filename.mp3"
-        media_extensions = {'.mp3', '.mp4', '.wav', '.flac', '.avi', '.mkv', '.webm', '.m4a', '.ogg'}
-        media_files = []
-        
-        for line in result.stdout.strip().split('\n'):
-            if not line.strip():
-                continue
-                
-            # Split by whitespace, first part is size, rest is filename
-            parts = line.strip().split(None, 1)
-            if len(parts) != 2:
-                continue
-                
-            size_bytes, filename = parts
-            
-            # Check if it's a media file
-            if any(filename.lower().endswith(ext) for ext in media_extensions):
-                try:
-                    # Convert size to human readable format
-                    size_int = int(size_bytes)
-                    size_str = size(size_int)
-                except:
-                    size_str = "Unknown"
-                
-                media_files.append({
-                    'name': filename,
-                    'size': size_str,
-                    'path': f"gdrive:youtube-downloads/{filename}"
-                })
-        
-        # Sort alphabetically by filename
-        media_files.sort(key=lambda x: x['name'].lower())
-        
-        logger.info(f"Found {len(media_files)} media files in Google Drive")
-        return media_files
-        
-    except subprocess.TimeoutExpired:
-        logger.error("Timeout listing Google Drive files")
-        return []
-    except Exception as e:
-        logger.error(f"Error getting media files from Google Drive: {e}")
-        return []
-
-
 def get_media_files_from_path(storage_path, backend=None):
     """
     Get all media files from a specific storage path or cloud backend.
     Returns list of file info dictionaries.
     """
-    # For Google Drive backend, use rclone to list files
-    if backend == 'gdrive':
-        return get_media_files_from_gdrive()
+    # For cloud backends, use the cached remote listing
+    if backend and storage_manager.is_cloud_backend(backend):
+        return get_indexed_media_files(backend, storage_path)[0]
     
     # For local storage, use filesystem
     try:
@@ -280,7 +257,7 @@ def get_media_files_from_path(storage_path, backend=None):
             return []
         
         # Get all media files
-        media_extensions = {'.mp3', '.mp4', '.wav', '.flac', '.avi', '.mkv', '.webm', '.m4a', '.ogg'}
+        media_extensions = MEDIA_EXTENSIONS
         media_files = []
         
         for filename in os.listdir(storage_path):
@@ -308,6 +285,45 @@ def get_media_files_from_path(storage_path, backend=None):
         return []
 
 
+def get_indexed_media_files(backend, storage_path, query=None, offset=0, limit=None):
+    """
+    Get media files of a backend from the media index, optionally only those matching query.
+    Cloud backends are indexed from their remote listing, other backends from storage_path.
+    Returns one page of file info dictionaries and the total number of files.
+    """
+    media_index = get_media_index()
+    if storage_manager.is_cloud_backend(backend):
+        get_remote_listing().ensure_fresh(backend)
+    else:
+        media_index.ensure_scanned(backend, storage_path)
+    if query:
+        rows, total = media_index.search(backend, query, offset, limit)
+    else:
+        rows, total = media_index.list_files(backend, offset, limit)
+    
+    media_files = [
+        {'name': row['name'], 'size': size(row['size']), 'path': row['path']}
+        for row in rows
+    ]
+    return media_files, total
+
+
+def get_indexed_directories():
+    """Backend directories kept in the media index (cloud backends are listed with rclone)."""
+    return {
+        backend: storage_manager.get_storage_path(backend)
+        for backend in storage_manager.get_available_backends()
+        if not storage_manager.is_cloud_backend(backend)
+    }
+
+
+def get_backend_location(backend, storage_path):
+    """Describe where the files of a backend are, for /ls and /search messages."""
+    if storage_manager.is_cloud_backend(backend):
+        return f"☁️ Remote: `{get_remote_listing().get_remote(backend)}`"
+    return f"📂 Location: `{storage_path}`"
+
+
 def get_media_files_list():
     """
     Legacy function for backward compatibility.
@@ -329,54 +345,128 @@ def get_media_files_list():
         return None, None
 
 
-def format_file_list(media_files, title="📁 **Media Files**", backend=None, max_length=4000):
+def format_file_page(media_files, title="📁 **Media Files**", backend=None, total=None, offset=0):
     """
-    Format media files list for display with automatic chunking.
-    Returns list of message chunks.
+    Format one page of a media file listing for display.
+    media_files is the page starting at offset of a listing with total files;
+    only this page is rendered, so the cost does not depend on the library size.
     """
-    if not media_files:
-        return []
+    if total is None:
+        total = len(media_files)
     
-    file_list = f"{title} ({len(media_files)} files)\n"
+    lines = [f"{title} ({total} files)"]
     
     # Show appropriate location based on backend
-    if backend == 'gdrive':
-        file_list += f"☁️ Google Drive: `gdrive:youtube-downloads`\n\n"
+    if backend:
+        lines.append(get_backend_location(backend, storage_manager.get_storage_path(backend)))
     else:
-        file_list += f"📂 Location: `{os.getenv('LOCAL_STORAGE_DIR', './data')}`\n\n"
+        lines.append(f"📂 Location: `{os.getenv('LOCAL_STORAGE_DIR', './data')}`")
+    
+    if total > LIST_PAGE_SIZE:
+        page = offset // LIST_PAGE_SIZE + 1
+        pages = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+        lines.append(f"📄 Page {page}/{pages}")
+    lines.append("")
     
-    for i, file_info in enumerate(media_files, 1):
+    for i, file_info in enumerate(media_files, offset + 1):
         # Determine emoji based on file extension
         name = file_info['name']
-        if name.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.ogg')):
+        if name.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.ogg', '.opus', '.mka')):
             emoji = "🎵"
         else:
             emoji = "🎬"
         
-        file_list += f"{i:2d}. {emoji} `{name}`\n"
-        file_list += f"     📊 Size: {file_info['size']}\n\n"
-    
-    # Split message if too long for Telegram
-    if len(file_list) <= max_length:
-        return [file_list]
-    
-    # Split into chunks
-    chunks = []
-    lines = file_list.split('\n')
-    current_chunk = lines[0] + '\n' + lines[1] + '\n\n'  # Header
-    
-    for line in lines[2:]:
-        if len(current_chunk + line + '\n') > max_length:
-            if current_chunk.strip():
-                chunks.append(current_chunk)
-            current_chunk = line + '\n'
-        else:
-            current_chunk += line + '\n'
+        # Shorten very long names so a full page always fits into one message
+        if len(name) > MAX_LISTED_NAME_LENGTH:
+            name = name[:MAX_LISTED_NAME_LENGTH - 1] + "…"
+        
+        lines.append(f"{i:2d}. {emoji} `{name}`")
+        lines.append(f"     📊 Size: {file_info['size']}")
+        lines.append("")
+    
+    return "\n".join(lines)
+
+
+def register_listing(backend, backend_name, search_query=None):
+    """
+    Remember a listing shown with page buttons and return its cursor id.
+    Only the most recent listings are kept.
+    """
+    global listing_cursor_counter
+    with listing_cursors_lock:
+        listing_cursor_counter += 1
+        listing_cursors[listing_cursor_counter] = (backend, backend_name, search_query)
+        while len(listing_cursors) > MAX_LISTING_CURSORS:
+            listing_cursors.popitem(last=False)
+        return listing_cursor_counter
+
+
+def build_page_keyboard(cursor_id, offset, total):
+    """Build the ◀/▶ buttons of a listing page, or None if everything fits on one page."""
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton(
+            "◀", callback_data=f"page_{cursor_id}_{max(0, offset - LIST_PAGE_SIZE)}"))
+    if offset + LIST_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton(
+            "▶", callback_data=f"page_{cursor_id}_{offset + LIST_PAGE_SIZE}"))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup([buttons])
+
+
+def render_listing_page(cursor_id, offset):
+    """
+    Render the page of a remembered listing starting at offset.
+    Returns message text and keyboard, or (None, None) if the listing is gone.
+    """
+    with listing_cursors_lock:
+        listing = listing_cursors.get(cursor_id)
+    if listing is None:
+        return None, None
+    backend, backend_name, search_query = listing
+    
+    storage_path = storage_manager.get_storage_path(backend)
+    media_files, total = get_indexed_media_files(backend, storage_path, search_query, offset, LIST_PAGE_SIZE)
+    if not media_files and offset > 0:
+        # Files were removed meanwhile, show the last page instead
+        offset = max(0, (total - 1) // LIST_PAGE_SIZE * LIST_PAGE_SIZE)
+        media_files, total = get_indexed_media_files(backend, storage_path, search_query, offset, LIST_PAGE_SIZE)
+    
+    if search_query:
+        title = f"🔎 **Search Results in {backend_name}**\n🔍 Query: `{search_query}`"
+    else:
+        title = f"📁 **{backend_name} Files**"
+    message = format_file_page(media_files, title, backend, total, offset)
+    return message, build_page_keyboard(cursor_id, offset, total)
+
+
+def handle_page_selection(update, context):
+    """
+    Handle the ◀/▶ buttons of /ls and /search results.
+    """
+    query = update.callback_query
+    if not is_trusted(query.from_user.id):
+        query.answer()
+        return
+    
+    # Parse callback data: page_cursor_offset
+    parts = query.data.split('_')
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+        query.answer("❌ Invalid page")
+        return
     
-    if current_chunk.strip():
-        chunks.append(current_chunk)
+    message, reply_markup = render_listing_page(int(parts[1]), int(parts[2]))
+    if message is None:
+        query.answer("⌛ This listing expired, please run the command again")
+        query.edit_message_reply_markup(reply_markup=None)
+        return
     
-    return chunks
+    query.answer()
+    try:
+        query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
+    except Exception as e:
+        logger.warning(f"Could not show listing page: {e}")
 
 
 def search_command(update, context):
@@ -398,7 +488,8 @@ def search_command(update, context):
             "• `/search music`\n"
             "• `/search infraction`\n"
             "• `/search mp3` (search by file extension)\n\n"
-            "Search is case-insensitive and matches anywhere in the filename.\n"
+            "Search matches file names, titles and uploaders, tolerates typos and accents "
+            "and shows the best matches first.\n"
             "⚠️ Only alphanumeric characters, spaces, dots, hyphens and underscores are allowed.",
             parse_mode='Markdown'
         )
@@ -450,6 +541,12 @@ def start(update, context):
         help_command(update, context)
         return ConversationHandler.END
 
+    # Several links in one message, e.g. a pasted list, are downloaded as one batch
+    urls = extract_urls(message_text)
+    if len(urls) > 1:
+        return start_batch(update, context, urls)
+    context.user_data.pop("urls", None)
+
     # update global URL object
     url = message_text
 
@@ -466,33 +563,79 @@ def start(update, context):
         update.message.reply_text(error_msg, parse_mode='Markdown')
         return ConversationHandler.END
     
-    # Send immediate feedback that bot is alive and processing
-    checking_msg = update.message.reply_text("🔍 Checking URL...")
+    return proceed_to_storage_selection(update, context)
+
+
+def start_from_document(update, context):
+    """
+    Invoked for text documents: all links of the file (and its caption) are downloaded as one batch.
+    """
+    user = update.message.from_user
+    if not is_trusted(user.id):
+        logger.info(
+            "Ignoring link list of untrusted user '%s' with id '%s'", user.first_name, user.id)
+        return None
+    
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_LINK_LIST_SIZE:
+        update.message.reply_text(f"❌ Link list too large!\n\nPlease send files up to {size(MAX_LINK_LIST_SIZE)}.")
+        return ConversationHandler.END
     
-    # Delete the "checking" message
     try:
-        checking_msg.delete()
-    except:
-        pass
-    
-    # Check if we should ask for storage backend (with retry for heartbeat detection)
-    import time
-    max_retries = 3
-    retry_delay = 2
-    
-    for attempt in range(max_retries):
-        if storage_manager.should_ask_for_backend():
-            # Multiple backends available, ask user to choose
-            return select_storage_backend(update, context)
-        
-        # Check if we found any backends or if this is the last attempt
-        available_backends = storage_manager.get_available_backends()
-        if len(available_backends) > 1 or attempt == max_retries - 1:
-            break
-            
-        # Wait a bit for rclone containers to start their heartbeats
-        logger.info(f"Waiting for rclone backends to start (attempt {attempt + 1}/{max_retries})...")
-        time.sleep(retry_delay)
+        content = context.bot.get_file(document.file_id).download_as_bytearray()
+    except Exception as e:
+        logger.error(f"Could not fetch link list {document.file_name}: {e}")
+        update.message.reply_text("❌ Could not read the file, please try again.")
+        return ConversationHandler.END
+    
+    text = bytes(content).decode('utf-8', errors='replace')
+    urls = extract_urls(f"{text}\n{update.message.caption or ''}")
+    logger.info(f"User {user.first_name} sent link list {document.file_name} with {len(urls)} links")
+    if not urls:
+        update.message.reply_text(f"❌ No links found in {document.file_name}")
+        return ConversationHandler.END
+    return start_batch(update, context, urls)
+
+
+def start_batch(update, context, urls):
+    """
+    Start downloading several links as one batch with a single progress message.
+    Links failing the quick check are reported and left out. Every link is
+    downloaded in its best format, so only backend and output format are asked once.
+    """
+    valid_urls = []
+    rejected_urls = []
+    for url in urls:
+        is_valid_quick, _ = quick_url_check(url)
+        (valid_urls if is_valid_quick else rejected_urls).append(url)
+    
+    if rejected_urls:
+        lines = [f"⚠️ Skipping {len(rejected_urls)} invalid or unsupported links:"]
+        lines += [f"• {url[:80]}" for url in rejected_urls[:MAX_LISTED_REJECTED_LINKS]]
+        if len(rejected_urls) > MAX_LISTED_REJECTED_LINKS:
+            lines.append(f"… and {len(rejected_urls) - MAX_LISTED_REJECTED_LINKS} more")
+        update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+    if not valid_urls:
+        update.message.reply_text("❌ None of the links can be downloaded.\nSend `/help` for more info.",
+                                  parse_mode='Markdown')
+        return ConversationHandler.END
+    
+    context.user_data["urls"] = valid_urls
+    context.user_data["url"] = f"{len(valid_urls)} links"
+    context.user_data["original_message_id"] = update.message.message_id
+    logger.info(f"User {update.message.from_user.first_name} started a batch of {len(valid_urls)} links")
+    
+    return proceed_to_storage_selection(update, context)
+
+
+def proceed_to_storage_selection(update, context):
+    """
+    Determine the storage backend, asking the user if several are available.
+    """
+    # Running backends are tracked by the storage manager's watcher, so no waiting here
+    if storage_manager.should_ask_for_backend():
+        # Multiple backends available, ask user to choose
+        return select_storage_backend(update, context)
     
     # Use default backend or only available backend
     default_backend = storage_manager.get_default_backend()
@@ -500,15 +643,9 @@ def start(update, context):
         context.user_data["storage_backend"] = default_backend
         logger.info(f"Using default storage backend: {default_backend}")
     else:
-        # Check available backends one more time
-        available_backends = storage_manager.get_available_backends()
-        if len(available_backends) > 1:
-            # Multiple backends found after retry, ask user
-            return select_storage_backend(update, context)
-        else:
-            # Only local storage available
-            context.user_data["storage_backend"] = "local"
-            logger.info("Using local storage (only backend available)")
+        # Only local storage available
+        context.user_data["storage_backend"] = "local"
+        logger.info("Using local storage (only backend available)")
     
     # Proceed to format selection or direct download
     return proceed_to_format_selection(update, context)
@@ -526,6 +663,23 @@ def build_menu(buttons, n_cols, header_buttons=None, footer_buttons=None):
     return menu
 
 
+def build_output_format_keyboard():
+    """
+    Build the output format menu. "Original audio" keeps the best audio stream
+    as it is (m4a, opus, ...), MP3 re-encodes it.
+    """
+    keyboard = [
+        [
+            InlineKeyboardButton("MP4", callback_data=CALLBACK_MP4),
+            InlineKeyboardButton("MP3", callback_data=CALLBACK_MP3),
+        ],
+        [
+            InlineKeyboardButton("🎧 Original audio", callback_data=CALLBACK_AUDIO),
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
 def select_source_format(update, context):
     """
     A stage asking the user for the source format to be downloaded.
@@ -535,10 +689,19 @@ def select_source_format(update, context):
     query.answer()
     # get formats
     url = context.user_data["url"]
-    ydl_opts = {}
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        meta = ydl.extract_info(url, download=False)
-        formats = meta.get('formats', [meta])
+    # Cached so the download itself does not have to extract the info again
+    meta = get_metadata_cache().extract_info(url)
+    if meta.get('_type') == 'playlist':
+        # Items of a playlist have formats of their own, each is downloaded in its best format
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "Best Quality", callback_data=CALLBACK_BEST_FORMAT)]])
+        query.edit_message_text(
+            text=f"📃 This is a playlist with {len(meta.get('entries') or [])} items.\n"
+                 f"Each item is downloaded in its best format.",
+            reply_markup=reply_markup
+        )
+        return OUTPUT
+    formats = meta.get('formats', [meta])
 
     # dynamically build a format menu
     formats = sorted(formats, key=lambda k: k['ext'])
@@ -580,13 +743,7 @@ def select_output_format(update, context):
         return download_media_with_default_format(update, context)
     
     # Show format selection if no default is set
-    keyboard = [
-        [
-            InlineKeyboardButton("MP4", callback_data=CALLBACK_MP4),
-            InlineKeyboardButton("MP3", callback_data=CALLBACK_MP3),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = build_output_format_keyboard()
     query.edit_message_text(
         text="Choose Output Format", reply_markup=reply_markup
     )
@@ -606,8 +763,7 @@ def download_media_with_default_format(update, context):
     
     # Pass storage_manager to TaskData
     data = TaskData(url, backend, selected_format, update, output_format, storage_manager, original_message_id)
-    task = DownloadTask(data)
-    task.downloadVideo()
+    enqueue_download(update, data, context.bot)
 
     return ConversationHandler.END
 
@@ -618,6 +774,11 @@ def download_media(update, context):
     """
     logger.info("download()")
     query = update.callback_query
+    if context.user_data.get("urls"):
+        query.answer()
+        enqueue_batch(update, context, query.data)
+        return ConversationHandler.END
+    
     selected_format = context.user_data[CALLBACK_SELECT_FORMAT]
     url = context.user_data["url"]
     output_format = query.data
@@ -626,12 +787,147 @@ def download_media(update, context):
     
     # Pass storage_manager to TaskData
     data = TaskData(url, backend, selected_format, update, output_format, storage_manager, original_message_id)
-    task = DownloadTask(data)
-    task.downloadVideo()
+    enqueue_download(update, data, context.bot)
 
     return ConversationHandler.END
 
 
+def enqueue_download(update, data, bot=None):
+    """
+    Hand a download over to the download queue and report its queue position.
+    Returns immediately; the download itself runs on a queue worker.
+    """
+    task = DownloadTask(data, bot)
+    job_store = get_job_store()
+
+    # The same target was downloaded before and is still available
+    stored_file = job_store.find_stored_file(*task.dedup_key)
+    if stored_file:
+        logger.info(f"'{data.url}' already stored at {stored_file['file_path']}, skipping download")
+        backend_name = storage_manager.get_backend_display_name(data.storage)
+        get_message_scheduler().call(
+            task.chat_id, task.bot.send_message,
+            task.chat_id,
+            f"✅ Already downloaded!\n\n"
+            f"📁 File: {os.path.basename(stored_file['file_path'])}\n"
+            f"🎵 Format: {data.output_format.upper()}\n"
+            f"💾 Backend: {backend_name}\n"
+            f"📂 Location: {os.path.dirname(stored_file['file_path'])}/\n"
+            f"🔗 URL: {data.url[:50]}...",
+            disable_web_page_preview=True
+        )
+        return True
+
+    # The same target is already queued or downloading, follow that task
+    if inflight_registry.register_or_attach(task.dedup_key, task, task.chat_id):
+        return True
+
+    # Persist the job first so it survives a restart of the bot
+    data.job_id = job_store.create_job(
+        data.url, data.selected_format, data.output_format, data.storage,
+        task.chat_id, data.original_message_id
+    )
+
+    try:
+        position = get_download_queue().submit(task)
+    except QueueFullError as e:
+        logger.warning(f"Rejecting download of '{data.url}': {e}")
+        inflight_registry.release(task.dedup_key, task)
+        job_store.update_status(data.job_id, STATUS_FAILED, str(e))
+        get_message_scheduler().call(
+            task.chat_id, task.bot.send_message,
+            task.chat_id,
+            "🚦 Download queue is full!\n\nPlease try again in a few minutes."
+        )
+        return False
+
+    task.announce_queued(position)
+    return True
+
+
+def enqueue_batch(update, context, output_format):
+    """
+    Queue the links of a batch conversation as downloads reporting to one batch message.
+    The menu message of the conversation becomes the batch message.
+    """
+    urls = context.user_data.pop("urls")
+    backend = context.user_data.get("storage_backend", "local")
+    chat_id = update.effective_chat.id
+    
+    items = urls[:MAX_PLAYLIST_ITEMS]
+    text = f"📥 Queuing {len(items)} downloads..."
+    if hasattr(update, 'callback_query') and update.callback_query:
+        message_id = update.callback_query.message.message_id
+        get_message_scheduler().edit(context.bot, chat_id, message_id, text)
+    else:
+        message_id = get_message_scheduler().call(chat_id, context.bot.send_message, chat_id, text).message_id
+    
+    batch = DownloadBatch(context.bot, chat_id, message_id, f"Batch of {len(items)} links",
+                          len(items), len(urls) - len(items))
+    data = TaskData(None, backend, CALLBACK_BEST_FORMAT, None, output_format, storage_manager, chat_id=chat_id)
+    queue_batch_items(batch, [(url, None) for url in items], data, chat_id, context.bot)
+    batch.refresh()
+    logger.info(f"Queued batch of {len(items)} links for chat {chat_id}")
+
+
+def restore_batch(chat_id, message_id, title):
+    """
+    Recreate the batch of items interrupted by a restart. Its message keeps
+    counting the items that finished before the restart.
+    """
+    batch_jobs = get_job_store().get_batch_jobs(chat_id, message_id)
+    batch = DownloadBatch(get_bot(), chat_id, message_id, title or "Batch", len(batch_jobs))
+    for job in batch_jobs:
+        if job['status'] not in UNFINISHED_STATUSES:
+            error = job['error'] if job['status'] == STATUS_FAILED else None
+            batch.item_finished(job['id'], job['title'] or job['url'], error)
+    return batch
+
+
+def resume_unfinished_jobs():
+    """
+    Re-queue all jobs that were queued or running when the bot stopped.
+    Jobs keep their original progress message, which is updated once they run again.
+    """
+    job_store = get_job_store()
+    pruned = job_store.prune_finished_jobs()
+    if pruned:
+        logger.info(f"Pruned {pruned} finished jobs from job store")
+
+    jobs = job_store.get_unfinished_jobs()
+    if not jobs:
+        return
+
+    logger.info(f"Resuming {len(jobs)} unfinished download jobs")
+    download_queue = get_download_queue()
+    batches = {}
+    for job in jobs:
+        batch = None
+        if job['batch_message_id']:
+            batch_key = (job['chat_id'], job['batch_message_id'])
+            if batch_key not in batches:
+                batches[batch_key] = restore_batch(job['chat_id'], job['batch_message_id'], job['batch_title'])
+            batch = batches[batch_key]
+        data = TaskData(
+            job['url'], job['backend'], job['selected_format'], None, job['output_format'],
+            storage_manager, job['original_message_id'],
+            chat_id=job['chat_id'],
+            progress_message_id=job['progress_message_id'],
+            job_id=job['id']
+        )
+        task = DownloadTask(data, batch=batch, title=job['title'])
+        if batch:
+            followed = inflight_registry.register_or_follow(task.dedup_key, task)
+        else:
+            followed = inflight_registry.register_or_attach(task.dedup_key, task, task.chat_id)
+        if followed:
+            # Duplicate of a job resumed before, it is followed instead
+            job_store.update_status(job['id'], STATUS_DONE)
+            continue
+        position = download_queue.submit(task, force=True)
+        task.announce_queued(position)
+
+
 def select_storage_backend(update, context):
     """
     A stage asking the user for the storage backend.
@@ -683,11 +979,13 @@ def handle_storage_selection(update, context):
     backend_name = storage_manager.get_backend_display_name(backend)
     logger.info(f"User selected storage backend: {backend} ({backend_name})")
     
-    # Delete the storage selection message immediately to clean up UI
-    try:
-        query.message.delete()
-    except Exception as e:
-        logger.warning(f"Could not delete storage selection message: {e}")
+    # Delete the storage selection message immediately to clean up UI;
+    # batches keep it, it becomes their output format menu or batch message
+    if not context.user_data.get("urls"):
+        try:
+            query.message.delete()
+        except Exception as e:
+            logger.warning(f"Could not delete storage selection message: {e}")
     
     # Go directly to format selection without intermediate message
     return proceed_to_format_selection(update, context)
@@ -699,6 +997,21 @@ def proceed_to_format_selection(update, context):
     """
     url = context.user_data["url"]
     
+    if context.user_data.get("urls"):
+        # Batches are downloaded in the best format of each link, only the output format is asked
+        context.user_data[CALLBACK_SELECT_FORMAT] = CALLBACK_BEST_FORMAT
+        if DEFAULT_OUTPUT_FORMAT:
+            enqueue_batch(update, context, DEFAULT_OUTPUT_FORMAT)
+            return ConversationHandler.END
+        
+        reply_markup = build_output_format_keyboard()
+        text = f"Do you want me to download these {url}?\nChoose Output Format"
+        if hasattr(update, 'callback_query') and update.callback_query:
+            update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            update.message.reply_text(text, reply_markup=reply_markup)
+        return DOWNLOAD
+    
     # If DEFAULT_OUTPUT_FORMAT is set, start downloading immediately
     if DEFAULT_OUTPUT_FORMAT:
         logger.info(f"Auto-downloading with default format: {DEFAULT_OUTPUT_FORMAT}")
@@ -707,8 +1020,7 @@ def proceed_to_format_selection(update, context):
         backend = context.user_data.get("storage_backend", "local")
         original_message_id = context.user_data.get("original_message_id")
         data = TaskData(url, backend, CALLBACK_BEST_FORMAT, update, DEFAULT_OUTPUT_FORMAT, storage_manager, original_message_id)
-        task = DownloadTask(data)
-        task.downloadVideo()
+        enqueue_download(update, data, context.bot)
         return ConversationHandler.END
     else:
         # Show format selection for manual downloads
@@ -843,40 +1155,34 @@ def execute_ls_command(update_or_query, backend, backend_name):
     """
     try:
         storage_path = storage_manager.get_storage_path(backend)
-        media_files = get_media_files_from_path(storage_path, backend)
+        reply_markup = None
         
-        if not media_files:
-            if backend == 'gdrive':
-                message = f"📁 No media files found in: {backend_name}\n☁️ Google Drive: `gdrive:youtube-downloads`"
-            else:
-                message = f"📁 No media files found in: {backend_name}\n📂 Path: `{storage_path}`"
+        if get_indexed_media_files(backend, storage_path, limit=1)[1] == 0:
+            message = f"📁 No media files found in: {backend_name}\n{get_backend_location(backend, storage_path)}"
         else:
-            # Format and send the file list
-            title = f"📁 **{backend_name} Files** ({len(media_files)} files)"
-            chunks = format_file_list(media_files, title, backend)
-            message = chunks[0] if chunks else "📁 No files found"
+            # Render the first page, further pages are shown by the ◀/▶ buttons
+            cursor_id = register_listing(backend, backend_name)
+            message, reply_markup = render_listing_page(cursor_id, 0)
         
         # Check if this is from a callback query (button) or direct command
         if hasattr(update_or_query, 'callback_query') and update_or_query.callback_query:
             # From button selection - try to edit, if that fails send new message
             try:
-                update_or_query.callback_query.edit_message_text(message, parse_mode='Markdown')
+                update_or_query.callback_query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             except:
                 # Message was deleted, send new one
-                update_or_query.callback_query.message.reply_text(message, parse_mode='Markdown')
+                update_or_query.callback_query.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
         elif hasattr(update_or_query, 'edit_message_text'):
             # This is a CallbackQuery object directly - try to edit, if that fails send new message
             try:
-                update_or_query.edit_message_text(message, parse_mode='Markdown')
+                update_or_query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             except:
                 # Message was deleted, get chat_id and send new message
                 chat_id = update_or_query.message.chat_id if hasattr(update_or_query, 'message') else update_or_query.from_user.id
-                import telegram
-                bot = telegram.Bot(os.getenv('BOT_TOKEN'))
-                bot.send_message(chat_id, message, parse_mode='Markdown')
+                get_bot().send_message(chat_id, message, parse_mode='Markdown', reply_markup=reply_markup)
         else:
             # From direct command - use reply_text
-            update_or_query.message.reply_text(message, parse_mode='Markdown')
+            update_or_query.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             
     except Exception as e:
         logger.error(f"Error in ls command for backend {backend}: {e}")
@@ -893,9 +1199,7 @@ def execute_ls_command(update_or_query, backend, backend_name):
                 update_or_query.edit_message_text(error_msg)
             except:
                 chat_id = update_or_query.message.chat_id if hasattr(update_or_query, 'message') else update_or_query.from_user.id
-                import telegram
-                bot = telegram.Bot(os.getenv('BOT_TOKEN'))
-                bot.send_message(chat_id, error_msg)
+                get_bot().send_message(chat_id, error_msg)
         else:
             update_or_query.message.reply_text(error_msg)
 
@@ -906,57 +1210,46 @@ def execute_search_command(update_or_query, backend, backend_name, search_args):
     """
     try:
         search_query = ' '.join(search_args).strip()
+        reply_markup = None
         if not search_query:
             message = "🔎 No search query provided"
         else:
             search_query = sanitize_search_query(search_query)
             storage_path = storage_manager.get_storage_path(backend)
-            all_media_files = get_media_files_from_path(storage_path, backend)
-            
-            # Filter files by search query (case-insensitive)
-            search_query_lower = search_query.lower()
-            matching_files = [
-                file_info for file_info in all_media_files 
-                if search_query_lower in file_info['name'].lower()
-            ]
+            total_matches = get_indexed_media_files(backend, storage_path, search_query, limit=1)[1]
+            total_files = get_media_index().count_files(backend)
             
-            if not matching_files:
-                if backend == 'gdrive':
-                    location_info = "☁️ Google Drive: `gdrive:youtube-downloads`"
-                else:
-                    location_info = f"📂 Searched in: `{storage_path}`"
+            if total_matches == 0:
+                location_info = get_backend_location(backend, storage_path)
                 
                 message = (f"🔎 **No files found**\n\n"
                           f"No files matching `{search_query}` found in {backend_name}.\n\n"
                           f"{location_info}\n"
-                          f"📊 Total files in backend: {len(all_media_files)}")
+                          f"📊 Total files in backend: {total_files}")
             else:
-                # Format the search results
-                title = f"🔎 **Search Results in {backend_name}**\n🔍 Query: `{search_query}`"
-                chunks = format_file_list(matching_files, title, backend)
-                message = chunks[0] if chunks else "🔎 No results found"
+                # Render the first page of results, further pages are shown by the ◀/▶ buttons
+                cursor_id = register_listing(backend, backend_name, search_query)
+                message, reply_markup = render_listing_page(cursor_id, 0)
         
         # Check if this is from a callback query (button) or direct command
         if hasattr(update_or_query, 'callback_query') and update_or_query.callback_query:
             # From button selection - try to edit, if that fails send new message
             try:
-                update_or_query.callback_query.edit_message_text(message, parse_mode='Markdown')
+                update_or_query.callback_query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             except:
                 # Message was deleted, send new one
-                update_or_query.callback_query.message.reply_text(message, parse_mode='Markdown')
+                update_or_query.callback_query.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
         elif hasattr(update_or_query, 'edit_message_text'):
             # This is a CallbackQuery object directly - try to edit, if that fails send new message
             try:
-                update_or_query.edit_message_text(message, parse_mode='Markdown')
+                update_or_query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             except:
                 # Message was deleted, get chat_id and send new message
                 chat_id = update_or_query.message.chat_id if hasattr(update_or_query, 'message') else update_or_query.from_user.id
-                import telegram
-                bot = telegram.Bot(os.getenv('BOT_TOKEN'))
-                bot.send_message(chat_id, message, parse_mode='Markdown')
+                get_bot().send_message(chat_id, message, parse_mode='Markdown', reply_markup=reply_markup)
         else:
             # From direct command - use reply_text
-            update_or_query.message.reply_text(message, parse_mode='Markdown')
+            update_or_query.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
             
     except Exception as e:
         logger.error(f"Error in search command for backend {backend}: {e}")
@@ -973,9 +1266,7 @@ def execute_search_command(update_or_query, backend, backend_name, search_args):
                 update_or_query.edit_message_text(error_msg)
             except:
                 chat_id = update_or_query.message.chat_id if hasattr(update_or_query, 'message') else update_or_query.from_user.id
-                import telegram
-                bot = telegram.Bot(os.getenv('BOT_TOKEN'))
-                bot.send_message(chat_id, error_msg)
+                get_bot().send_message(chat_id, error_msg)
         else:
             update_or_query.message.reply_text(error_msg)
 
@@ -986,7 +1277,7 @@ def execute_storage_command(update_or_query, backend, backend_name):
     """
     try:
         # Get storage monitor instance
-        storage_monitor = get_storage_monitor(BOT_TOKEN)
+        storage_monitor = get_storage_monitor()
         
         # Send initial message - use same pattern as other execute functions
         if hasattr(update_or_query, 'callback_query') and update_or_query.callback_query:
@@ -1001,35 +1292,33 @@ def execute_storage_command(update_or_query, backend, backend_name):
             try:
                 storage_path = storage_manager.ensure_storage_path(backend)
                 
-                # Calculate directory size
-                total_size = 0
-                file_count = 0
-                for dirpath, dirnames, filenames in os.walk(storage_path):
-                    for filename in filenames:
-                        filepath = os.path.join(dirpath, filename)
-                        try:
-                            total_size += os.path.getsize(filepath)
-                            file_count += 1
-                        except (OSError, IOError):
-                            pass
+                # Totals of the media index, kept current by downloads and the reconciler
+                get_media_index().ensure_scanned(backend, storage_path)
+                usage = get_media_index().get_usage(backend)
+                file_count = sum(count for count, _ in usage.values())
+                total_size = sum(size for _, size in usage.values())
                 
                 # Format size
                 size_str = storage_monitor.format_storage_size(total_size)
+                format_lines = "".join(
+                    f"\n  - {fmt or 'other'}: {count} ({storage_monitor.format_storage_size(size)})"
+                    for fmt, (count, size) in sorted(usage.items(), key=lambda item: -item[1][1])
+                )
                 
                 # Get filesystem status for local backend
                 filesystem_status = storage_monitor.get_storage_status(backend, storage_path)
                 if filesystem_status:
                     storage_status = (
                         f"{filesystem_status}\n"
-                        f"• Files in directory: {file_count}\n"
-                        f"• Directory size: {size_str}\n"
+                        f"• Media files: {file_count}{format_lines}\n"
+                        f"• Media size: {size_str}\n"
                         f"• Path: {storage_path}"
                     )
                 else:
                     storage_status = (
                         f"💾 **{backend_name}**\n"
-                        f"• Files: {file_count}\n"
-                        f"• Directory size: {size_str}\n"
+                        f"• Media files: {file_count}{format_lines}\n"
+                        f"• Media size: {size_str}\n"
                         f"• Path: {storage_path}\n"
                         f"• Filesystem: ❌ Unable to check"
                     )
@@ -1077,23 +1366,50 @@ def execute_storage_command(update_or_query, backend, backend_name):
                 update_or_query.edit_message_text(error_msg)
             except:
                 chat_id = update_or_query.message.chat_id if hasattr(update_or_query, 'message') else update_or_query.from_user.id
-                import telegram
-                bot = telegram.Bot(os.getenv('BOT_TOKEN'))
-                bot.send_message(chat_id, error_msg)
+                get_bot().send_message(chat_id, error_msg)
         else:
             update_or_query.message.reply_text(error_msg)
 
 
 def main():
     # Create the Updater and pass it your bot's token.
-    updater = Updater(BOT_TOKEN)
+    # Its bot is shared by all downloads, see bot_client.py
+    updater = create_updater(BOT_TOKEN)
 
     # Get the dispatcher to register handlers
     dp = updater.dispatcher
 
+    # Register the running storage backends and keep tracking their heartbeats
+    storage_manager.start_watcher()
+
+    # Partial downloads are kept for retries, remove the ones nobody came back for
+    storage_manager.start_staging_collector()
+
+    # Keep the media index of /ls and /search in line with the backend directories
+    get_media_index().start_reconciler(get_indexed_directories)
+
+    # Follow the rclone upload events from now on, so none is missed;
+    # finished uploads go straight into the remote listings
+    get_log_tailer(DEFAULT_EVENT_FILE).add_listener(get_remote_listing().handle_event)
+    # Running uploads reserve their share of the bandwidth
+    get_log_tailer(DEFAULT_EVENT_FILE).add_listener(get_bandwidth_manager().handle_event)
+    get_log_tailer(DEFAULT_EVENT_FILE).start()
+    get_log_tailer(DEFAULT_LOG_FILE).start()
+
+    # Rate limit outgoing Telegram requests of all downloads and uploads
+    get_message_scheduler()
+
+    # Start the conversion workers and the download workers, then pick up jobs interrupted by a restart
+    get_transcoder()
+    get_download_queue()
+    resume_unfinished_jobs()
+
     # Add conversation handler with storage selection
     conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(Filters.text & ~Filters.command, start)],
+        entry_points=[
+            MessageHandler(Filters.text & ~Filters.command, start),
+            MessageHandler(Filters.document.mime_type('text/plain'), start_from_document),
+        ],
         states={
             STORAGE: [
                 CallbackQueryHandler(handle_storage_selection, pattern='^storage_'),
@@ -1106,6 +1422,7 @@ def main():
             DOWNLOAD: [
                 CallbackQueryHandler(download_media, pattern='^' + CALLBACK_MP3 + '$'),
                 CallbackQueryHandler(download_media, pattern='^' + CALLBACK_MP4 + '$'),
+                CallbackQueryHandler(download_media, pattern='^' + CALLBACK_AUDIO + '$'),
             ],
         },
         fallbacks=[CommandHandler('whoami', whoami)],
@@ -1118,6 +1435,7 @@ def main():
     dp.add_handler(CommandHandler('search', search_command))
     dp.add_handler(CommandHandler('storage', storage_command))
     dp.add_handler(CallbackQueryHandler(handle_command_backend_selection, pattern='^cmd_'))
+    dp.add_handler(CallbackQueryHandler(handle_page_selection, pattern='^page_'))
     dp.add_handler(conv_handler)
 
     # Start the Bot
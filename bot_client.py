@@ -0,0 +1,55 @@
+import os
+import logging
+
+import telegram
+from telegram.ext import Updater
+from telegram.utils.request import Request
+
+logger = logging.getLogger(__name__)
+
+# Worker threads of the telegram.ext dispatcher (Updater default)
+DISPATCHER_WORKERS = 4
+# Other threads talking to Telegram: update polling, message scheduler, upload trackers, storage monitor
+BACKGROUND_CONNECTIONS = 4
+
+
+def connection_pool_size() -> int:
+    """
+    Number of keep-alive HTTP connections to the Bot API.
+    Sized so every download worker, dispatcher worker and background thread
+    can hold a connection at the same time without waiting for the pool.
+    """
+    configured = os.getenv('TELEGRAM_CON_POOL_SIZE')
+    if configured:
+        return int(configured)
+    download_workers = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '2'))
+    return download_workers + DISPATCHER_WORKERS + BACKGROUND_CONNECTIONS
+
+
+# The process-wide bot client, set by create_updater() or created on first use
+shared_bot = None
+
+def create_updater(token: str) -> Updater:
+    """
+    Create the Updater with a connection pool sized for the download workers
+    and register its bot as the shared bot client.
+    """
+    global shared_bot
+    pool_size = connection_pool_size()
+    updater = Updater(token, workers=DISPATCHER_WORKERS, request_kwargs={'con_pool_size': pool_size})
+    shared_bot = updater.bot
+    logger.info(f"Telegram bot client uses a pool of {pool_size} connections")
+    return updater
+
+def get_bot() -> telegram.Bot:
+    """
+    Get the shared bot client (the dispatcher's bot once the Updater exists).
+    Outside of the bot process a client with its own pool is created once.
+    """
+    global shared_bot
+    if shared_bot is None:
+        shared_bot = telegram.Bot(
+            os.getenv('BOT_TOKEN'),
+            request=Request(con_pool_size=connection_pool_size())
+        )
+    return shared_bot
@@ -0,0 +1,116 @@
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from message_scheduler import get_message_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Active items and failures listed in a batch message, the rest are counted only
+MAX_LISTED_ACTIVE = 5
+MAX_LISTED_FAILURES = 10
+# Longer item titles are shortened in batch messages
+MAX_ITEM_TITLE_LENGTH = 50
+
+
+class DownloadBatch:
+    """
+    Progress of a group of downloads shown in one message, e.g. the items of a playlist.
+
+    Every item is an independent DownloadTask on the download queue, so items
+    download in parallel and a failing item does not affect the others. Items
+    report their progress texts and their result here instead of sending
+    messages of their own; the batch message shows the totals ("12/48 done,
+    3 active"), the current progress of active items and the failed items.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, title: str, total: int, skipped: int = 0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.title = title
+        self.total = total
+        # Entries of the source that could not be queued, e.g. beyond MAX_PLAYLIST_ITEMS
+        self.skipped = skipped
+
+        self._active = OrderedDict()  # task -> (item title, last progress text)
+        self._done = 0
+        self._failures = []  # (item title, error)
+        self._lock = threading.Lock()
+
+    def item_started(self, task, title: str) -> None:
+        """Show an item as active once a worker picked it up."""
+        with self._lock:
+            self._active[task] = (title, "🔄 Starting download...")
+        self.refresh()
+
+    def item_progress(self, task, text: str) -> None:
+        """Remember the latest progress text of an active item."""
+        with self._lock:
+            if task not in self._active:
+                return
+            self._active[task] = (self._active[task][0], text.split('\n', 1)[0])
+        self.refresh()
+
+    def item_finished(self, task, title: str, error: Optional[str] = None) -> None:
+        """Count an item as downloaded, or as failed if error is set."""
+        with self._lock:
+            self._active.pop(task, None)
+            self._done += 1
+            if error:
+                self._failures.append((title, error))
+        self.refresh()
+
+    def item_expanded(self, task, items: int, skipped: int = 0) -> None:
+        """Replace an item that turned out to be a playlist itself (e.g. a channel tab) by its items."""
+        with self._lock:
+            self._active.pop(task, None)
+            self.total += items - 1
+            self.skipped += skipped
+        self.refresh()
+
+    def format_message(self) -> str:
+        """Render the batch message."""
+        with self._lock:
+            done, active, failures = self._done, list(self._active.values()), list(self._failures)
+
+        succeeded = done - len(failures)
+        if done >= self.total:
+            lines = [f"✅ {self.title} finished!", f"📦 {succeeded}/{self.total} downloaded"]
+        else:
+            lines = [f"📃 {self.title}", f"📦 {done}/{self.total} done, {len(active)} active"]
+        if failures:
+            lines[-1] += f", {len(failures)} failed"
+        if self.skipped:
+            lines.append(f"⏭️ {self.skipped} more items skipped")
+
+        if active:
+            lines.append("")
+            for title, text in active[:MAX_LISTED_ACTIVE]:
+                lines.append(f"▶️ {shorten(title)}: {text}")
+            if len(active) > MAX_LISTED_ACTIVE:
+                lines.append(f"… and {len(active) - MAX_LISTED_ACTIVE} more")
+
+        if failures:
+            lines.append("")
+            for title, error in failures[:MAX_LISTED_FAILURES]:
+                lines.append(f"❌ {shorten(title)}: {shorten(error)}")
+            if len(failures) > MAX_LISTED_FAILURES:
+                lines.append(f"… and {len(failures) - MAX_LISTED_FAILURES} more failures")
+
+        return "\n".join(lines)
+
+    def refresh(self) -> None:
+        """Show the current state in the batch message."""
+        # Edits are coalesced by the scheduler, so frequent item updates are cheap
+        get_message_scheduler().edit(self.bot, self.chat_id, self.message_id, self.format_message(),
+                                     disable_web_page_preview=True)
+
+
+def shorten(text: str, length: int = MAX_ITEM_TITLE_LENGTH) -> str:
+    """Shorten text to length characters for a batch message."""
+    text = ' '.join(str(text).split())
+    if len(text) > length:
+        return text[:length - 1] + "…"
+    return text
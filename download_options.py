@@ -0,0 +1,69 @@
+import os
+import logging
+from typing import Dict
+
+from yt_dlp.utils import parse_bytes
+
+logger = logging.getLogger(__name__)
+
+# Arguments giving an external downloader its number of connections per download
+EXTERNAL_DOWNLOADER_CONNECTION_ARGS = {
+    'aria2c': lambda connections: ['--max-connection-per-server', str(connections),
+                                   '--split', str(connections), '--min-split-size', '1M'],
+    'axel': lambda connections: ['--num-connections', str(connections)],
+}
+
+
+def connections_per_download(fragment_concurrency: int, download_workers: int, max_total_connections: int) -> int:
+    """
+    Return the connections one download may open: the configured fragment
+    concurrency, limited so that all download workers running at the same
+    time stay within max_total_connections.
+    """
+    return max(1, min(fragment_concurrency, max_total_connections // max(1, download_workers)))
+
+
+def build_download_options(fragment_concurrency: int = 4, http_chunk_size: int = None,
+                           external_downloader: str = None, download_workers: int = 2,
+                           max_total_connections: int = 16) -> Dict:
+    """
+    Build the yt-dlp options controlling how a single download uses the network.
+
+    Args:
+        fragment_concurrency: DASH/HLS fragments downloaded in parallel per download
+        http_chunk_size: Bytes requested per HTTP range request, None to request whole files
+        external_downloader: Downloader binary used instead of yt-dlp's own (e.g. aria2c), None for native
+        download_workers: Downloads running at the same time (MAX_CONCURRENT_DOWNLOADS)
+        max_total_connections: Connections all running downloads together may open
+    """
+    connections = connections_per_download(fragment_concurrency, download_workers, max_total_connections)
+    options = {'concurrent_fragment_downloads': connections}
+    if http_chunk_size:
+        options['http_chunk_size'] = http_chunk_size
+
+    if external_downloader:
+        options['external_downloader'] = {'default': external_downloader}
+        connection_args = EXTERNAL_DOWNLOADER_CONNECTION_ARGS.get(os.path.basename(external_downloader))
+        if connection_args:
+            options['external_downloader_args'] = {
+                os.path.basename(external_downloader): connection_args(connections)
+            }
+    return options
+
+
+# yt-dlp network options shared by all downloads
+download_options = None
+
+def get_download_options() -> Dict:
+    """Get the yt-dlp network options of downloads, configured from the environment."""
+    global download_options
+    if download_options is None:
+        download_options = build_download_options(
+            fragment_concurrency=int(os.getenv('FRAGMENT_CONCURRENCY', '4')),
+            http_chunk_size=parse_bytes(os.getenv('HTTP_CHUNK_SIZE', '10M')),
+            external_downloader=os.getenv('EXTERNAL_DOWNLOADER') or None,
+            download_workers=int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '2')),
+            max_total_connections=int(os.getenv('MAX_TOTAL_CONNECTIONS', '16'))
+        )
+        logger.info(f"Download network options: {download_options}")
+    return download_options
@@ -0,0 +1,125 @@
+import os
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the pending download queue has no free slot left."""
+
+
+class DownloadQueue:
+    """
+    Runs download tasks on a fixed pool of worker threads so the Telegram
+    dispatcher returns immediately instead of waiting for yt-dlp and FFmpeg.
+
+    Tasks only need a run() method. Pending tasks are kept in a bounded
+    FIFO queue; submit() raises QueueFullError once it is exhausted.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 50):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+
+        self._pending = deque()
+        self._active = 0
+        self._condition = threading.Condition()
+        self._workers = []
+        self._running = False
+
+    def start(self) -> None:
+        """Start the worker threads (idempotent)."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        for index in range(self.max_workers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"download-worker-{index + 1}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+        logger.info(f"Download queue started with {self.max_workers} workers "
+                    f"and {self.max_pending} pending slots")
+
+    def stop(self) -> None:
+        """Stop accepting work and let the workers exit after their current task."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+    def submit(self, task, force: bool = False) -> int:
+        """
+        Add a task to the queue.
+
+        Args:
+            task: Object with a run() method
+            force: Accept the task even if the pending queue is full
+                   (used for jobs restored after a restart)
+
+        Returns:
+            Position in the queue (0 if a worker is free and the task starts right away)
+
+        Raises:
+            QueueFullError: if the pending queue is full
+        """
+        with self._condition:
+            if not force and len(self._pending) >= self.max_pending:
+                raise QueueFullError(f"Download queue is full ({self.max_pending} pending)")
+
+            self._pending.append(task)
+            idle_workers = self.max_workers - self._active
+            position = max(0, len(self._pending) - idle_workers)
+            self._condition.notify()
+
+        logger.info(f"Queued download task (position {position}, {self._active} active)")
+        return position
+
+    def stats(self) -> dict:
+        """Return a snapshot of the queue state."""
+        with self._condition:
+            return {
+                'active': self._active,
+                'pending': len(self._pending),
+                'workers': self.max_workers,
+                'max_pending': self.max_pending
+            }
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                task = self._pending.popleft()
+                self._active += 1
+
+            try:
+                task.run()
+            except Exception as e:
+                logger.error(f"Download task crashed: {e}")
+            finally:
+                with self._condition:
+                    self._active -= 1
+
+
+# Global download queue instance
+download_queue = None
+
+def get_download_queue() -> DownloadQueue:
+    """Get or create the global download queue, configured from the environment."""
+    global download_queue
+    if download_queue is None:
+        download_queue = DownloadQueue(
+            max_workers=int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '2')),
+            max_pending=int(os.getenv('MAX_PENDING_DOWNLOADS', '50'))
+        )
+        download_queue.start()
+    return download_queue
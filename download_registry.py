@@ -0,0 +1,76 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightRegistry:
+    """
+    Registry of downloads that are queued or running, keyed by download target
+    (video or playlist id, selected format, output format, backend).
+
+    A second request for a target that is already in flight is attached to the
+    running task as a follower instead of downloading the same video again.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def register_or_attach(self, key, task, chat_id: int):
+        """
+        Register task as the download for key, or attach chat_id to the task
+        already registered for key.
+
+        Returns:
+            The task chat_id was attached to, or None if task was registered
+        """
+        with self._lock:
+            existing = self._tasks.get(key)
+            if existing is None:
+                self._tasks[key] = task
+                return None
+
+            # Recorded under the lock so the running task cannot finish in between
+            follower = existing.attach_follower(chat_id)
+
+        # Sending the message may wait for Telegram rate limits, keep the registry usable meanwhile
+        existing.announce_follower(follower)
+        logger.info(f"Attached chat {chat_id} to in-flight download {key}")
+        return existing
+
+    def register_or_follow(self, key, task):
+        """
+        Register task, an item of a batch, as the download for key, or let the task
+        already registered for key report its result to the batch of task too.
+        No message is sent, the item is shown in its batch message.
+
+        Returns:
+            The task that is followed, or None if task was registered
+        """
+        with self._lock:
+            existing = self._tasks.get(key)
+            if existing is None:
+                self._tasks[key] = task
+                return None
+
+            # Recorded under the lock so the running task cannot finish in between
+            existing.add_batch_follower(task)
+
+        task.batch.item_started(task, task.title)
+        logger.info(f"Batch item {key} follows in-flight download")
+        return existing
+
+    def release(self, key, task) -> None:
+        """Remove task from the registry; no more followers can attach afterwards."""
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._tasks)
+
+
+# Global instance for easy access
+inflight_registry = InFlightRegistry()
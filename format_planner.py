@@ -0,0 +1,81 @@
+import os
+from typing import List, Optional, Tuple
+
+# Output formats of the bot: a video file, an MP3, or the original audio stream without re-encoding
+OUTPUT_MP4 = 'mp4'
+OUTPUT_MP3 = 'mp3'
+OUTPUT_AUDIO = 'audio'
+AUDIO_OUTPUT_FORMATS = (OUTPUT_MP3, OUTPUT_AUDIO)
+
+# FFmpeg output options of MP3 encodes
+MP3_FFMPEG_ARGS = ['-vn', '-codec:a', 'libmp3lame', '-b:a', '192k']
+# FFmpeg output options copying the audio stream into another container
+COPY_AUDIO_FFMPEG_ARGS = ['-vn', '-codec:a', 'copy']
+
+# Container the original audio is stored in, by codec; other codecs go into Matroska audio
+AUDIO_CONTAINERS = {
+    'mp3': 'mp3',
+    'mp4a': 'm4a',
+    'aac': 'm4a',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+    'flac': 'flac',
+}
+FALLBACK_AUDIO_CONTAINER = 'mka'
+
+
+def plan_format(selected_format: str, output_format: str) -> str:
+    """
+    Return the yt-dlp format selector of a download.
+    Audio outputs in best quality only download the best audio stream instead of
+    the muxed video; explicitly selected formats are kept.
+    """
+    if output_format in AUDIO_OUTPUT_FORMATS and selected_format == 'best':
+        return 'bestaudio/best'
+    return selected_format
+
+
+def audio_codec(acodec: Optional[str]) -> Optional[str]:
+    """Normalize a yt-dlp acodec like 'mp4a.40.2' to 'mp4a', None if there is no audio codec."""
+    if not acodec or acodec == 'none':
+        return None
+    return acodec.split('.')[0].lower()
+
+
+def plan_conversion(file_path: str, output_format: str,
+                    acodec: Optional[str] = None) -> Optional[Tuple[str, List[str]]]:
+    """
+    Decide how a downloaded file becomes the requested output.
+
+    Args:
+        file_path: Downloaded file
+        output_format: One of the OUTPUT_* formats
+        acodec: Audio codec of the download as reported by yt-dlp, if known
+
+    Returns:
+        None if the file already is the output, otherwise the output path and the
+        FFmpeg options producing it: a stream copy (remux) where the codec allows,
+        an MP3 encode otherwise
+    """
+    base, extension = os.path.splitext(file_path)
+    extension = extension.lstrip('.').lower()
+    codec = audio_codec(acodec)
+
+    if output_format == OUTPUT_MP3:
+        if extension == 'mp3':
+            return None
+        if codec == 'mp3':
+            return f"{base}.mp3", COPY_AUDIO_FFMPEG_ARGS
+        return f"{base}.mp3", MP3_FFMPEG_ARGS
+
+    if output_format == OUTPUT_AUDIO:
+        if codec is None and extension in AUDIO_CONTAINERS.values():
+            # Unknown codec but already an audio file
+            return None
+        container = AUDIO_CONTAINERS.get(codec, FALLBACK_AUDIO_CONTAINER)
+        if extension == container:
+            return None
+        return f"{base}.{container}", COPY_AUDIO_FFMPEG_ARGS
+
+    # Videos are kept as downloaded
+    return None
@@ -0,0 +1,204 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+UNFINISHED_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class JobStore:
+    """
+    Durable record of download jobs in a SQLite database.
+
+    Every job queued by the bot is stored together with everything needed to
+    run it again (URL, formats, backend, chat and progress message), so jobs
+    that were queued or running when the bot stopped can be resumed on startup.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+
+        logger.info(f"Job store initialized at {db_path}")
+
+    def _create_schema(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    selected_format TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    progress_message_id INTEGER,
+                    original_message_id INTEGER,
+                    title TEXT,
+                    batch_message_id INTEGER,
+                    batch_title TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+            # Content index of finished downloads, used to answer repeated requests instantly
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS stored_files (
+                    video_key TEXT NOT NULL,
+                    selected_format TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    uploaded INTEGER NOT NULL DEFAULT 0,
+                    stored_at REAL NOT NULL,
+                    PRIMARY KEY (video_key, selected_format, output_format, backend)
+                )
+            """)
+
+    def create_job(self, url: str, selected_format: str, output_format: str, backend: str,
+                   chat_id: int, original_message_id: int = None, title: str = None,
+                   batch_message_id: int = None, batch_title: str = None) -> int:
+        """
+        Record a new queued job and return its id.
+        Items of a batch name the batch message they report to, so the batch
+        can be shown again when they are resumed.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """INSERT INTO jobs (url, selected_format, output_format, backend, chat_id,
+                                     original_message_id, title, batch_message_id, batch_title,
+                                     status, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (url, selected_format, output_format, backend, chat_id,
+                 original_message_id, title, batch_message_id, batch_title, STATUS_QUEUED, now, now)
+            )
+            return cursor.lastrowid
+
+    def set_progress_message(self, job_id: int, message_id: int) -> None:
+        """Remember which message shows the progress of a job."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET progress_message_id = ?, updated_at = ? WHERE id = ?',
+                (message_id, time.time(), job_id)
+            )
+
+    def update_status(self, job_id: int, status: str, error: str = None) -> None:
+        """Update the status of a job."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                (status, error, time.time(), job_id)
+            )
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """Return a single job as dict or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_unfinished_jobs(self) -> List[Dict]:
+        """Return all jobs that were queued or running, oldest first."""
+        placeholders = ','.join('?' for _ in UNFINISHED_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY id',
+                UNFINISHED_STATUSES
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_batch_jobs(self, chat_id: int, batch_message_id: int) -> List[Dict]:
+        """Return all jobs of the batch shown in batch_message_id, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM jobs WHERE chat_id = ? AND batch_message_id = ? ORDER BY id',
+                (chat_id, batch_message_id)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def prune_finished_jobs(self, max_age_days: int = 7) -> int:
+        """Delete finished jobs older than max_age_days. Returns number of deleted jobs."""
+        cutoff = time.time() - max_age_days * 24 * 3600
+        placeholders = ','.join('?' for _ in UNFINISHED_STATUSES)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f'DELETE FROM jobs WHERE status NOT IN ({placeholders}) AND updated_at < ?',
+                UNFINISHED_STATUSES + (cutoff,)
+            )
+            return cursor.rowcount
+
+    def record_stored_file(self, video_key: str, selected_format: str, output_format: str,
+                           backend: str, file_path: str) -> None:
+        """Remember where the result of a download was stored."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO stored_files
+                   (video_key, selected_format, output_format, backend, file_path, uploaded, stored_at)
+                   VALUES (?, ?, ?, ?, ?, 0, ?)""",
+                (video_key, selected_format, output_format, backend, file_path, time.time())
+            )
+
+    def mark_uploaded(self, backend: str, file_path: str) -> None:
+        """Mark a stored file as uploaded to its cloud backend."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE stored_files SET uploaded = 1 WHERE backend = ? AND file_path = ?',
+                (backend, file_path)
+            )
+
+    def find_stored_file(self, video_key: str, selected_format: str, output_format: str,
+                         backend: str) -> Optional[Dict]:
+        """
+        Return the stored file for a download target, or None.
+        Entries whose file is neither on disk nor uploaded are dropped.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT * FROM stored_files WHERE video_key = ? AND selected_format = ?
+                   AND output_format = ? AND backend = ?""",
+                (video_key, selected_format, output_format, backend)
+            ).fetchone()
+        if row is None:
+            return None
+
+        entry = dict(row)
+        if entry['uploaded'] or os.path.exists(entry['file_path']):
+            return entry
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                """DELETE FROM stored_files WHERE video_key = ? AND selected_format = ?
+                   AND output_format = ? AND backend = ?""",
+                (video_key, selected_format, output_format, backend)
+            )
+        return None
+
+
+# Global job store instance
+job_store = None
+
+def get_job_store() -> JobStore:
+    """Get or create the global job store inside LOCAL_STORAGE_DIR."""
+    global job_store
+    if job_store is None:
+        data_dir = os.getenv('LOCAL_STORAGE_DIR', '/home/bot/data')
+        job_store = JobStore(os.path.join(data_dir, '.jobs.sqlite3'))
+    return job_store
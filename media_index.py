@@ -0,0 +1,310 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from typing import Callable, Dict, List, Tuple
+
+from search_engine import SearchEngine
+
+logger = logging.getLogger(__name__)
+
+MEDIA_EXTENSIONS = {'.mp3', '.mp4', '.wav', '.flac', '.avi', '.mkv', '.webm', '.m4a', '.ogg', '.opus', '.mka'}
+
+
+def is_media_file(filename: str) -> bool:
+    """Check whether filename has one of the media extensions shown by /ls and /search."""
+    return os.path.splitext(filename)[1].lower() in MEDIA_EXTENSIONS
+
+
+class MediaIndex:
+    """
+    Persistent index of the media files of every backend in a SQLite database.
+
+    Each entry stores name, size, mtime, format, source URL, backend and, for
+    downloads of the bot, title and uploader of a file, so /ls and /search are
+    answered from the index instead of listing and sorting the backend directory
+    on every command. Searches are ranked by the in-process SearchEngine, which
+    is built from the index on first use and updated with every change. Running
+    totals per backend and format back /storage, see get_usage().
+
+    The index is updated when a download is finalized and reconciled with the
+    backend directories by a background scanner, see start_reconciler().
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+
+        # Backends reconciled at least once since startup
+        self._scanned = set()
+        self._reconciler_thread = None
+        self._search_engine = None
+        # backend -> {format: [file count, bytes]}, kept current with every change
+        self._usage = None
+
+        logger.info(f"Media index initialized at {db_path}")
+
+    def _create_schema(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS media_files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    backend TEXT NOT NULL,
+                    path TEXT NOT NULL UNIQUE,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    format TEXT NOT NULL,
+                    source_url TEXT,
+                    title TEXT,
+                    uploader TEXT,
+                    indexed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS media_files_name ON media_files (backend, name COLLATE NOCASE)'
+            )
+
+    def upsert_entry(self, backend: str, path: str, name: str, size: int, mtime: float,
+                     source_url: str = None, title: str = None, uploader: str = None) -> None:
+        """Add or update a file. Known source URL, title and uploader are kept if none are given."""
+        file_format = os.path.splitext(name)[1].lstrip('.').lower()
+        with self._lock, self._conn:
+            if self._usage is not None:
+                old = self._conn.execute(
+                    'SELECT backend, format, size FROM media_files WHERE path = ?', (path,)
+                ).fetchone()
+                if old:
+                    self._add_usage(old['backend'], old['format'], -1, -old['size'])
+                self._add_usage(backend, file_format, 1, size)
+            self._conn.execute(
+                """INSERT INTO media_files (backend, path, name, size, mtime, format, source_url,
+                                            title, uploader, indexed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (path) DO UPDATE SET
+                       backend = excluded.backend, name = excluded.name, size = excluded.size,
+                       mtime = excluded.mtime, format = excluded.format,
+                       source_url = COALESCE(excluded.source_url, media_files.source_url),
+                       title = COALESCE(excluded.title, media_files.title),
+                       uploader = COALESCE(excluded.uploader, media_files.uploader),
+                       indexed_at = excluded.indexed_at""",
+                (backend, path, name, size, mtime, file_format, source_url, title, uploader, time.time())
+            )
+            if self._search_engine is not None:
+                row = self._conn.execute(
+                    'SELECT id, backend, name, title, uploader FROM media_files WHERE path = ?', (path,)
+                ).fetchone()
+                self._search_engine.add(*row)
+
+    def upsert_file(self, backend: str, path: str, source_url: str = None,
+                    title: str = None, uploader: str = None) -> None:
+        """Add or update a file on disk, e.g. once a download has been finalized."""
+        stat = os.stat(path)
+        self.upsert_entry(backend, path, os.path.basename(path), stat.st_size, stat.st_mtime,
+                          source_url, title, uploader)
+
+    def remove_files(self, paths: List[str]) -> None:
+        """Remove files from the index."""
+        with self._lock, self._conn:
+            if self._search_engine is not None or self._usage is not None:
+                for path in paths:
+                    row = self._conn.execute(
+                        'SELECT id, backend, format, size FROM media_files WHERE path = ?', (path,)
+                    ).fetchone()
+                    if not row:
+                        continue
+                    if self._search_engine is not None:
+                        self._search_engine.remove(row['id'])
+                    if self._usage is not None:
+                        self._add_usage(row['backend'], row['format'], -1, -row['size'])
+            self._conn.executemany('DELETE FROM media_files WHERE path = ?', [(path,) for path in paths])
+
+    def remove_file(self, path: str) -> None:
+        """Remove a file from the index."""
+        self.remove_files([path])
+
+    def count_files(self, backend: str) -> int:
+        """Return the number of indexed files of a backend."""
+        with self._lock:
+            row = self._conn.execute('SELECT COUNT(*) FROM media_files WHERE backend = ?', (backend,)).fetchone()
+        return row[0]
+
+    def _add_usage(self, backend: str, file_format: str, count: int, size: int) -> None:
+        """Adjust the running totals of a backend. Must be called with the lock held."""
+        totals = self._usage.setdefault(backend, {}).setdefault(file_format, [0, 0])
+        totals[0] += count
+        totals[1] += size
+        if totals[0] <= 0:
+            del self._usage[backend][file_format]
+
+    def _load_usage(self) -> None:
+        """Compute the running totals from the index. Must be called with the lock held."""
+        usage = {}
+        for row in self._conn.execute(
+            'SELECT backend, format, COUNT(*), SUM(size) FROM media_files GROUP BY backend, format'
+        ):
+            usage.setdefault(row[0], {})[row[1]] = [row[2], row[3] or 0]
+        self._usage = usage
+
+    def get_usage(self, backend: str) -> Dict[str, Tuple[int, int]]:
+        """
+        Return {format: (file count, bytes)} of the indexed files of a backend.
+        Totals are computed once and then updated with every change of the index.
+        """
+        with self._lock:
+            if self._usage is None:
+                self._load_usage()
+            return {fmt: (count, size) for fmt, (count, size) in self._usage.get(backend, {}).items()}
+
+    def list_files(self, backend: str, offset: int = 0, limit: int = None) -> Tuple[List[Dict], int]:
+        """
+        Return one page of the files of a backend sorted by name, and the total file count.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT * FROM media_files WHERE backend = ?
+                   ORDER BY name COLLATE NOCASE LIMIT ? OFFSET ?""",
+                (backend, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows], self.count_files(backend)
+
+    def _get_search_engine(self) -> SearchEngine:
+        """Build the search engine from the index on first use, later it is updated per change."""
+        with self._lock:
+            if self._search_engine is None:
+                started_at = time.time()
+                engine = SearchEngine()
+                engine.build(self._conn.execute('SELECT id, backend, name, title, uploader FROM media_files'))
+                self._search_engine = engine
+                logger.info(f"Search engine built over {len(engine)} files in {time.time() - started_at:.2f}s")
+            return self._search_engine
+
+    def search(self, backend: str, query: str, offset: int = 0, limit: int = None) -> Tuple[List[Dict], int]:
+        """
+        Return one page of the files of a backend matching query, best matches
+        first, and the total number of matches. See SearchEngine for matching.
+        """
+        doc_ids, total = self._get_search_engine().search(backend, query, offset, limit)
+        if not doc_ids:
+            return [], total
+
+        placeholders = ','.join('?' for _ in doc_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM media_files WHERE id IN ({placeholders})', doc_ids
+            ).fetchall()
+        rows_by_id = {row['id']: dict(row) for row in rows}
+        return [rows_by_id[doc_id] for doc_id in doc_ids if doc_id in rows_by_id], total
+
+    def reconcile_entries(self, backend: str, entries: Dict[str, Tuple[str, int, float]],
+                          since: float = None) -> Tuple[int, int]:
+        """
+        Bring the index of a backend in line with a complete listing of its files.
+
+        Args:
+            backend: Backend the listing belongs to
+            entries: {path: (name, size, mtime)} of all files of the backend
+            since: Time the listing was taken; entries indexed later are kept even if missing
+
+        Returns:
+            Number of added or updated and of removed entries
+        """
+        with self._lock:
+            indexed = {
+                row['path']: (row['size'], row['mtime'], row['indexed_at'])
+                for row in self._conn.execute(
+                    'SELECT path, size, mtime, indexed_at FROM media_files WHERE backend = ?', (backend,)
+                )
+            }
+
+        changed = 0
+        for path, (name, file_size, mtime) in entries.items():
+            if indexed.get(path, (None, None, None))[:2] != (file_size, mtime):
+                self.upsert_entry(backend, path, name, file_size, mtime)
+                changed += 1
+
+        removed = [path for path, (_, _, indexed_at) in indexed.items()
+                   if path not in entries and (since is None or indexed_at < since)]
+        if removed:
+            self.remove_files(removed)
+
+        self._scanned.add(backend)
+        with self._lock:
+            if self._usage is not None:
+                # Recount so the running totals can never drift from the index
+                self._load_usage()
+        if changed or removed:
+            logger.info(f"Media index of '{backend}' reconciled: {changed} updated, {len(removed)} removed")
+        return changed, len(removed)
+
+    def reconcile_directory(self, backend: str, directory: str) -> Tuple[int, int]:
+        """
+        Bring the index of a backend in line with the media files at the top level of directory.
+        Returns the number of added or updated and of removed entries.
+        """
+        started_at = time.time()
+        on_disk = {}
+        if os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not is_media_file(entry.name):
+                        continue
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            on_disk[entry.path] = (entry.name, stat.st_size, stat.st_mtime)
+                    except OSError:
+                        pass
+
+        return self.reconcile_entries(backend, on_disk, since=started_at)
+
+    def ensure_scanned(self, backend: str, directory: str) -> None:
+        """Reconcile a backend now if it was not scanned since startup."""
+        if backend not in self._scanned:
+            self.reconcile_directory(backend, directory)
+
+    def start_reconciler(self, get_directories: Callable[[], Dict[str, str]], interval: float = None) -> None:
+        """
+        Reconcile the index with the backend directories in a background thread.
+
+        Args:
+            get_directories: Callable returning {backend: directory} of the backends to scan
+            interval: Seconds between scans (default: MEDIA_INDEX_SCAN_INTERVAL or 300)
+        """
+        if self._reconciler_thread is not None:
+            return
+        if interval is None:
+            interval = float(os.getenv('MEDIA_INDEX_SCAN_INTERVAL', '300'))
+
+        def reconcile():
+            while True:
+                try:
+                    for backend, directory in get_directories().items():
+                        self.reconcile_directory(backend, directory)
+                except Exception as e:
+                    logger.error(f"Error reconciling media index: {e}")
+                time.sleep(interval)
+
+        self._reconciler_thread = threading.Thread(target=reconcile, name="media-index-reconciler", daemon=True)
+        self._reconciler_thread.start()
+        logger.info(f"Media index reconciler started (interval {interval}s)")
+
+
+# Global media index instance
+media_index = None
+
+def get_media_index() -> MediaIndex:
+    """Get or create the global media index inside LOCAL_STORAGE_DIR."""
+    global media_index
+    if media_index is None:
+        data_dir = os.getenv('LOCAL_STORAGE_DIR', '/home/bot/data')
+        media_index = MediaIndex(os.path.join(data_dir, '.media.sqlite3'))
+    return media_index
@@ -0,0 +1,221 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class MessageScheduler:
+    """
+    Central scheduler for outgoing Telegram Bot API requests.
+
+    Every request gets a send slot that respects a per-chat interval
+    (Telegram allows about one message per second in a chat and fewer in
+    groups) and a global rate across all chats. A 429 answer (RetryAfter)
+    pauses all requests for the time Telegram asks for.
+
+    Message edits are asynchronous and coalesced: only the latest pending
+    text of a message is sent, so progress updates of many concurrent
+    downloads never pile up behind each other. Requests whose result is
+    needed (send_message, delete_message) go through call() and block
+    until their slot is due.
+    """
+
+    # Remembered texts of sent edits, used to skip edits that would not change anything
+    MAX_SENT_TEXTS = 1000
+
+    def __init__(self, global_rate: float = 25.0, chat_interval: float = 1.0,
+                 group_interval: float = 3.0):
+        self.global_interval = 1.0 / max(0.1, global_rate)
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+
+        self._pending = OrderedDict()  # (chat_id, message_id) -> (bot, text, kwargs)
+        self._sent_texts = OrderedDict()  # (chat_id, message_id) -> (text, kwargs) of the last sent edit
+        self._chat_next = {}  # chat_id -> earliest time of the next request
+        self._global_next = 0.0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    def start(self) -> None:
+        """Start the edit dispatcher thread (idempotent)."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        self._thread = threading.Thread(target=self._dispatch_loop, name="message-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Message scheduler started ({1 / self.global_interval:.0f} requests/s, "
+                    f"{self.chat_interval}s per chat, {self.group_interval}s per group)")
+
+    def stop(self) -> None:
+        """Stop the dispatcher thread; pending edits are dropped."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+    def edit(self, bot, chat_id: int, message_id: int, text: str, **kwargs) -> None:
+        """
+        Queue an edit of a message. Returns immediately.
+        A newer edit of the same message replaces a pending older one.
+        """
+        if not message_id:
+            return
+
+        key = (chat_id, message_id)
+        with self._condition:
+            if key in self._pending:
+                self.coalesced += 1
+                # Keep the queue position of the older edit so busy messages are not starved
+                self._pending[key] = (bot, text, kwargs)
+            else:
+                if self._sent_texts.get(key) != (text, kwargs):
+                    self._pending[key] = (bot, text, kwargs)
+            self._condition.notify()
+
+    def call(self, chat_id: int, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a Bot API request for chat_id once its send slot is due and return its result.
+        Requests answered with RetryAfter are retried after the requested delay.
+        """
+        attempts = 3
+        for attempt in range(attempts):
+            with self._condition:
+                slot = self._reserve_slot(chat_id, time.time())
+            delay = slot - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                result = func(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                self._pause(e.retry_after)
+                if attempt == attempts - 1:
+                    raise
+
+    def stats(self) -> Dict[str, int]:
+        """Return scheduler counters."""
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'rate_limited': self.rate_limited
+            }
+
+    def _interval_for(self, chat_id: int) -> float:
+        # Group and channel ids are negative
+        return self.group_interval if chat_id < 0 else self.chat_interval
+
+    def _ready_time(self, chat_id: int) -> float:
+        return max(self._chat_next.get(chat_id, 0.0), self._global_next, self._paused_until)
+
+    def _reserve_slot(self, chat_id: int, now: float) -> float:
+        """Reserve the next send slot for chat_id. Must be called with the lock held."""
+        slot = max(now, self._ready_time(chat_id))
+        self._chat_next[chat_id] = slot + self._interval_for(chat_id)
+        self._global_next = slot + self.global_interval
+        return slot
+
+    def _pause(self, retry_after: float) -> None:
+        with self._condition:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.time() + retry_after)
+            self._condition.notify_all()
+        logger.warning(f"Telegram flood control, pausing requests for {retry_after}s")
+
+    def _next_edit(self):
+        """
+        Wait for the pending edit that may be sent first and take it from the queue.
+        Returns (key, edit) or None once the scheduler is stopped.
+        """
+        with self._condition:
+            while self._running:
+                now = time.time()
+                best_key, best_time = None, None
+                for key in self._pending:
+                    ready = self._ready_time(key[0])
+                    if best_time is None or ready < best_time:
+                        best_key, best_time = key, ready
+                    if ready <= now:
+                        break
+
+                if best_key is not None and best_time <= now:
+                    self._reserve_slot(best_key[0], now)
+                    return best_key, self._pending.pop(best_key)
+
+                self._condition.wait(timeout=None if best_key is None else best_time - now)
+        return None
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            item = self._next_edit()
+            if item is None:
+                return
+            key, (bot, text, kwargs) = item
+            self._send_edit(key, bot, text, kwargs)
+
+    def _send_edit(self, key, bot, text: str, kwargs: dict) -> None:
+        chat_id, message_id = key
+        try:
+            bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, **kwargs)
+            self.sent += 1
+        except RetryAfter as e:
+            self._pause(e.retry_after)
+            # Send again later unless a newer text arrived meanwhile
+            with self._condition:
+                if key not in self._pending:
+                    self._pending[key] = (bot, text, kwargs)
+                    self._pending.move_to_end(key, last=False)
+            return
+        except BadRequest as e:
+            message = str(e).lower()
+            if 'not modified' in message:
+                pass
+            elif "can't parse entities" in message and 'parse_mode' in kwargs:
+                # Markdown broke on e.g. an underscore in a filename, send the text as is
+                kwargs = {k: v for k, v in kwargs.items() if k != 'parse_mode'}
+                self.edit(bot, chat_id, message_id, text, **kwargs)
+                return
+            else:
+                logger.warning(f"Failed to edit message {message_id} in chat {chat_id}: {e}")
+                return
+        except Exception as e:
+            logger.warning(f"Failed to edit message {message_id} in chat {chat_id}: {e}")
+            return
+
+        with self._condition:
+            self._sent_texts[key] = (text, kwargs)
+            self._sent_texts.move_to_end(key)
+            while len(self._sent_texts) > self.MAX_SENT_TEXTS:
+                self._sent_texts.popitem(last=False)
+
+
+# Global message scheduler instance
+message_scheduler = None
+
+def get_message_scheduler() -> MessageScheduler:
+    """Get or create the global message scheduler, configured from the environment."""
+    global message_scheduler
+    if message_scheduler is None:
+        message_scheduler = MessageScheduler(
+            global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', '25')),
+            chat_interval=float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1.0')),
+            group_interval=float(os.getenv('TELEGRAM_GROUP_INTERVAL', '3.0'))
+        )
+        message_scheduler.start()
+    return message_scheduler
@@ -0,0 +1,149 @@
+import os
+import re
+import copy
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# Matches the 11 character video id of the common YouTube URL shapes
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([0-9A-Za-z_-]{11})'
+)
+# Matches the playlist id of YouTube URLs carrying one, e.g. watch?v=...&list=PL...
+YOUTUBE_LIST_PATTERN = re.compile(r'(?:youtube\.com|youtu\.be)/\S*[?&]list=([0-9A-Za-z_-]+)')
+
+
+def normalize_video_id(url: str) -> str:
+    """
+    Return a cache key identifying the video behind a URL.
+    Different URL forms of the same YouTube video map to the same key,
+    other URLs are keyed by the URL without fragment and surrounding whitespace.
+    A video URL with a list parameter is extracted as the playlist, so the list
+    stays part of its key.
+    """
+    url = url.strip()
+    match = YOUTUBE_ID_PATTERN.search(url)
+    if match:
+        list_match = YOUTUBE_LIST_PATTERN.search(url)
+        if list_match:
+            return f"youtube:{match.group(1)}&list={list_match.group(1)}"
+        return f"youtube:{match.group(1)}"
+    return url.split('#', 1)[0]
+
+
+def download_target(url: str) -> str:
+    """
+    Return the key identifying what downloading url fetches: the playlist for
+    YouTube URLs with a list parameter, whichever video of the list they point
+    at, otherwise the video as keyed by normalize_video_id().
+    """
+    list_match = YOUTUBE_LIST_PATTERN.search(url.strip())
+    if list_match:
+        return f"youtube:playlist:{list_match.group(1)}"
+    return normalize_video_id(url)
+
+
+class MetadataCache:
+    """
+    TTL/LRU cache of yt-dlp info dicts (extract_info(download=False)).
+
+    Lets the format menu and the actual download share one extraction:
+    the download reuses the cached info via YoutubeDL.process_ie_result().
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: int = 600, playlist_end: int = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        # Entries of a playlist listed at most, the same for every cached info
+        self.playlist_end = playlist_end
+
+        self._entries = OrderedDict()  # key -> (timestamp, info)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Return a copy of the cached info for url, or None if missing or expired."""
+        key = normalize_video_id(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            timestamp, info = entry
+            if time.time() - timestamp > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        # yt-dlp mutates info dicts while processing them
+        return copy.deepcopy(info)
+
+    def put(self, url: str, info: Dict) -> None:
+        """Store info for url, evicting the least recently used entries if full."""
+        key = normalize_video_id(url)
+        with self._lock:
+            self._entries[key] = (time.time(), copy.deepcopy(info))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def extract_info(self, url: str) -> Dict:
+        """
+        Return the yt-dlp info dict for url without downloading,
+        using the cache when possible. Entries of playlists are flat (url and title only)
+        and limited to playlist_end.
+        """
+        info = self.get(url)
+        if info is not None:
+            logger.info(f"Metadata cache hit for {normalize_video_id(url)}")
+            return info
+
+        # Playlists are listed without extracting every item, items are extracted when they are downloaded;
+        # entries beyond playlist_end are never downloaded, so they are not listed either
+        options = {'extract_flat': 'in_playlist'}
+        if self.playlist_end:
+            options['playlistend'] = self.playlist_end
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+        self.put(url, info)
+        return info
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache counters."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# Global metadata cache instance
+metadata_cache = None
+
+def get_metadata_cache() -> MetadataCache:
+    """Get or create the global metadata cache, configured from the environment."""
+    global metadata_cache
+    if metadata_cache is None:
+        metadata_cache = MetadataCache(
+            max_entries=int(os.getenv('METADATA_CACHE_SIZE', '128')),
+            ttl=int(os.getenv('METADATA_CACHE_TTL', '600')),
+            playlist_end=int(os.getenv('MAX_PLAYLIST_ITEMS', '100'))
+        )
+    return metadata_cache
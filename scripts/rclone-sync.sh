@@ -10,18 +10,58 @@ REMOTE_NAME="${RCLONE_REMOTE_NAME:-gdrive}"
 REMOTE_PATH="${RCLONE_REMOTE_PATH:-youtube-downloads}"
 LOCAL_PATH="${RCLONE_LOCAL_PATH:-/data/gdrive}"
 LOG_FILE="${RCLONE_LOG_FILE:-/logs/rclone-upload.log}"
+EVENT_FILE="${RCLONE_EVENT_FILE:-/logs/rclone-events.jsonl}"  # Machine-readable upload events
+EVENT_FILE_MAX_BYTES="${RCLONE_EVENT_FILE_MAX_BYTES:-10485760}"
 CHECK_INTERVAL="${RCLONE_CHECK_INTERVAL:-1}"  # Fallback check interval in seconds
+MAX_PARALLEL_UPLOADS="${RCLONE_MAX_PARALLEL_UPLOADS:-4}"  # Concurrent uploads
+MAX_LARGE_UPLOADS="${RCLONE_MAX_LARGE_UPLOADS:-1}"  # Concurrent uploads of large files
+LARGE_FILE_BYTES=$(( ${RCLONE_LARGE_FILE_MB:-200} * 1024 * 1024 ))
+RETRY_DELAY="${RCLONE_RETRY_DELAY:-60}"  # Seconds before a failed upload is retried
+INFLIGHT_DIR="/tmp/rclone-sync/inflight"
+FAILED_DIR="/tmp/rclone-sync/failed"
 HEARTBEAT_FILE="${LOCAL_PATH}/.rclone-heartbeat"
+REMOTE_FILE="${LOCAL_PATH}/.rclone-remote"  # Tells the bot where uploaded files can be listed
 
 # Ensure directories exist
 mkdir -p "$(dirname "$LOG_FILE")"
+mkdir -p "$(dirname "$EVENT_FILE")"
 mkdir -p "$LOCAL_PATH"
+rm -rf "$INFLIGHT_DIR" "$FAILED_DIR"
+mkdir -p "$INFLIGHT_DIR" "$FAILED_DIR"
 
 # Logging function
 log() {
     echo "[$(date '+%a %b %d %H:%M:%S UTC %Y')] $1" | tee -a "$LOG_FILE"
 }
 
+# Escape a string for use inside a JSON string
+json_escape() {
+    printf '%s' "$1" | sed -e 's/\\/\\\\/g' -e 's/"/\\"/g'
+}
+
+# Append one upload event as a JSON line to the event file
+# Usage: emit_event <event> <job id> <filename> [extra JSON fields, starting with a comma]
+emit_event() {
+    printf '{"time":%s,"event":"%s","job":"%s","backend":"%s","file":"%s"%s}\n' \
+        "$(date '+%s')" "$1" "$2" "$(json_escape "$REMOTE_NAME")" "$(json_escape "$3")" "$4" >> "$EVENT_FILE"
+}
+
+# Copy rclone output to the log file and turn its JSON stats lines into progress events
+# Usage: forward_progress <job id> <filename>
+forward_progress() {
+    while IFS= read -r line; do
+        echo "$line" >> "$LOG_FILE"
+        case "$line" in
+            *'"stats":'*) emit_event "progress" "$1" "$2" ",\"rclone\":$line" ;;
+        esac
+    done
+}
+
+# Generate a unique id for one upload
+new_job_id() {
+    cat /proc/sys/kernel/random/uuid 2>/dev/null || echo "$(date '+%s')-$$-$1"
+}
+
 # Update heartbeat file
 update_heartbeat() {
     echo "$(date '+%s')" > "$HEARTBEAT_FILE"
@@ -31,73 +71,121 @@ update_heartbeat() {
 upload_file() {
     local file_path="$1"
     local filename=$(basename "$file_path")
+    local job_id=$(new_job_id "$filename")
+    local size=$(stat -c %s "$file_path" 2>/dev/null || echo 0)
+    local status_file="/tmp/rclone-status-$job_id"
     
     log "📤 Uploading: $filename"
+    emit_event "start" "$job_id" "$filename" ",\"size\":$size"
     
-    # Upload file to remote
-    if rclone copy "$file_path" "$REMOTE_NAME:$REMOTE_PATH" \
-        --config /config/rclone.conf \
-        --log-level INFO \
-        --stats 1s \
-        --progress 2>&1 | tee -a "$LOG_FILE"; then
-        
+    # Upload file to remote; the exit code is passed through a file
+    # because the pipeline status is the one of forward_progress
+    {
+        rclone copy "$file_path" "$REMOTE_NAME:$REMOTE_PATH" \
+            --config /config/rclone.conf \
+            --log-level INFO \
+            --stats 1s \
+            --use-json-log 2>&1
+        echo $? > "$status_file"
+    } | forward_progress "$job_id" "$filename"
+    local status=$(cat "$status_file" 2>/dev/null || echo 1)
+    rm -f "$status_file"
+    
+    if [ "$status" -eq 0 ]; then
         # Upload successful, delete local file
         if rm "$file_path"; then
             log "✅ Upload completed and local file deleted: $filename"
         else
             log "⚠️  Upload completed but failed to delete local file: $filename"
         fi
+        emit_event "done" "$job_id" "$filename" ",\"size\":$size"
     else
         log "❌ Upload failed for: $filename"
+        emit_event "failed" "$job_id" "$filename" ",\"exit_code\":$status"
         return 1
     fi
 }
 
-# Process all existing files in directory
-process_existing_files() {
-    log "🔍 Checking for existing files in $LOCAL_PATH"
+# Count running uploads, optionally only those of one lane (small or large)
+count_uploads() {
+    ls "$INFLIGHT_DIR" 2>/dev/null | grep -c "^${1}" || true
+}
+
+# Upload one file in the background and keep an in-flight marker while it runs
+# Usage: upload_worker <file> <lane>
+upload_worker() {
+    local file_path="$1"
+    local filename=$(basename "$file_path")
+    local marker="$INFLIGHT_DIR/$2-$filename"
+    
+    if upload_file "$file_path"; then
+        rm -f "$FAILED_DIR/$filename"
+    else
+        # Do not retry right away, see RETRY_DELAY
+        date '+%s' > "$FAILED_DIR/$filename"
+    fi
+    rm -f "$marker"
+}
+
+# Start uploads for waiting files while upload slots are free.
+# Smallest files go first so they are not stuck behind big ones, while up to
+# MAX_LARGE_UPLOADS slots are kept for large files so those still make progress.
+schedule_uploads() {
+    local now=$(date '+%s')
+    local queue_file="/tmp/rclone-sync/queue"
     
-    local file_count=0
     for file in "$LOCAL_PATH"/*; do
-        # Skip if no files match the pattern
-        [ -e "$file" ] || continue
-        
-        # Skip directories
+        # Skip directories and the heartbeat file
         [ -f "$file" ] || continue
-        
-        upload_file "$file"
-        file_count=$((file_count + 1))
-    done
+        [ "$(basename "$file")" = ".rclone-heartbeat" ] && continue
+        echo "$(stat -c %s "$file") $file"
+    done | sort -n > "$queue_file"
     
-    if [ $file_count -eq 0 ]; then
-        log "📂 No existing files found"
-    else
-        log "📊 Processed $file_count existing files"
-    fi
+    # Slots reserved for large files, as long as there are large files
+    local large_files=$(awk -v limit="$LARGE_FILE_BYTES" '$1 >= limit' "$queue_file" | wc -l)
+    local reserved=$MAX_LARGE_UPLOADS
+    [ "$large_files" -lt "$reserved" ] && reserved=$large_files
+    local small_slots=$((MAX_PARALLEL_UPLOADS - reserved))
+    
+    while read -r size file; do
+        local filename=$(basename "$file")
+        
+        # Skip files that are already uploading
+        [ -e "$INFLIGHT_DIR/small-$filename" ] || [ -e "$INFLIGHT_DIR/large-$filename" ] && continue
+        
+        # Skip files whose last upload failed recently
+        if [ -f "$FAILED_DIR/$filename" ] && [ $((now - $(cat "$FAILED_DIR/$filename"))) -lt "$RETRY_DELAY" ]; then
+            continue
+        fi
+        
+        [ "$(count_uploads)" -lt "$MAX_PARALLEL_UPLOADS" ] || break
+        
+        local lane="small"
+        if [ "$size" -ge "$LARGE_FILE_BYTES" ]; then
+            lane="large"
+            [ "$(count_uploads large-)" -lt "$MAX_LARGE_UPLOADS" ] || continue
+        else
+            [ "$(count_uploads small-)" -lt "$small_slots" ] || continue
+        fi
+        
+        log "🔔 File detected: $filename ($lane, $size bytes)"
+        touch "$INFLIGHT_DIR/$lane-$filename"
+        upload_worker "$file" "$lane" &
+    done < "$queue_file"
 }
 
 # Monitor directory for new files using inotify
 monitor_with_inotify() {
     log "👁️  Starting inotify monitoring on $LOCAL_PATH"
     
-    # Monitor for file creation and moves (when files are moved into the directory)
-    inotifywait -m -e close_write,moved_to "$LOCAL_PATH" --format '%w%f %e' 2>/dev/null | while read file event; do
-        # Update heartbeat
+    while true; do
         update_heartbeat
+        schedule_uploads
         
-        # Skip if not a regular file
-        [ -f "$file" ] || continue
-        
-        # Skip heartbeat file itself
-        [ "$(basename "$file")" = ".rclone-heartbeat" ] && continue
-        
-        log "🔔 File detected: $(basename "$file") (event: $event)"
-        
-        # Small delay to ensure file is completely written
-        sleep 0.5
-        
-        # Upload the file
-        upload_file "$file"
+        # Wake up on file creation and moves (when files are moved into the directory),
+        # or after CHECK_INTERVAL to fill upload slots that became free
+        inotifywait -qq -t "$CHECK_INTERVAL" -e close_write,moved_to \
+            --exclude '\.rclone-(heartbeat|remote)$' "$LOCAL_PATH" 2>/dev/null || true
     done
 }
 
@@ -106,23 +194,8 @@ monitor_with_polling() {
     log "⏰ Starting polling monitoring (every ${CHECK_INTERVAL}s) on $LOCAL_PATH"
     
     while true; do
-        # Update heartbeat
         update_heartbeat
-        
-        for file in "$LOCAL_PATH"/*; do
-            # Skip if no files match the pattern
-            [ -e "$file" ] || continue
-            
-            # Skip directories
-            [ -f "$file" ] || continue
-            
-            # Skip heartbeat file itself
-            [ "$(basename "$file")" = ".rclone-heartbeat" ] && continue
-            
-            log "🔔 File detected: $(basename "$file")"
-            upload_file "$file"
-        done
-        
+        schedule_uploads
         sleep "$CHECK_INTERVAL"
     done
 }
@@ -133,6 +206,14 @@ main() {
     log "📂 Local path: $LOCAL_PATH"
     log "☁️  Remote: $REMOTE_NAME:$REMOTE_PATH"
     log "📝 Log file: $LOG_FILE"
+    log "⚡ Parallel uploads: $MAX_PARALLEL_UPLOADS (large files: $MAX_LARGE_UPLOADS)"
+    log "🧾 Event file: $EVENT_FILE"
+    
+    # Start a fresh event file once it grows too large
+    if [ -f "$EVENT_FILE" ] && [ "$(stat -c %s "$EVENT_FILE")" -gt "$EVENT_FILE_MAX_BYTES" ]; then
+        mv "$EVENT_FILE" "$EVENT_FILE.1"
+    fi
+    emit_event "ready" "" ""
     
     # Test rclone configuration
     if ! rclone about "$REMOTE_NAME:" --config /config/rclone.conf >/dev/null 2>&1; then
@@ -145,9 +226,9 @@ main() {
     # Create initial heartbeat
     update_heartbeat
     log "💓 Heartbeat created: $HEARTBEAT_FILE"
+    echo "$REMOTE_NAME:$REMOTE_PATH" > "$REMOTE_FILE"
     
-    # Process any existing files first
-    process_existing_files
+    # Existing files are picked up by the first scheduling round of the monitor
     
     # Try to use inotify for real-time monitoring
     if command -v inotifywait >/dev/null 2>&1; then
@@ -0,0 +1,204 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Relative weight of a match in each indexed field
+FIELD_WEIGHTS = {'name': 1.0, 'title': 1.0, 'uploader': 0.6}
+
+# Weight of a query word matching an indexed word exactly, as its prefix or only similarly
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+# Query words need this many characters before similar words are matched
+MIN_FUZZY_LENGTH = 4
+# Minimal trigram similarity (Jaccard) of a similar word
+MIN_SIMILARITY = 0.3
+
+
+def fold_text(text: str) -> str:
+    """Lowercase text and strip diacritics, so "Beyoncé" and "beyonce" are the same."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into folded words; underscores, dots and dashes of filenames separate words."""
+    return TOKEN_PATTERN.findall(fold_text(text))
+
+
+def word_trigrams(word: str) -> Set[str]:
+    """Trigrams of a word padded with '$', so that the start and end of words count."""
+    padded = f"$${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def prefix_trigrams(prefix: str) -> Set[str]:
+    """Trigrams every word starting with prefix contains."""
+    padded = f"$${prefix}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchEngine:
+    """
+    In-process search over the media library.
+
+    Documents (name, title and uploader of a file) are split into folded words
+    kept in an inverted index; a trigram index over all known words finds words
+    starting with a query word and words similar to it, so queries with typos,
+    other word order or diacritics still match. Results are ranked by how many
+    query words match, how well they match and in which field.
+
+    The engine is built once from the media index and updated per file.
+    """
+
+    # Ranked results of recent queries, dropped on every change
+    CACHED_QUERIES = 32
+
+    def __init__(self):
+        self._docs = {}  # doc id -> (backend, sort key, folded text, {word: field weight})
+        self._postings = {}  # word -> set of doc ids
+        self._trigrams = {}  # trigram -> set of words
+        self._results = OrderedDict()  # (backend, query words) -> ranked doc ids
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: int, backend: str, name: str, title: str = None, uploader: str = None) -> None:
+        """Index a document, replacing an older version with the same id."""
+        words = {}
+        for field, text in (('name', name), ('title', title), ('uploader', uploader)):
+            for word in tokenize(text or ''):
+                words[word] = max(words.get(word, 0.0), FIELD_WEIGHTS[field])
+        folded = ' '.join(tokenize(name)) + ' | ' + ' '.join(tokenize(title or ''))
+
+        with self._lock:
+            self._remove(doc_id)
+            self._docs[doc_id] = (backend, name.lower(), folded, words)
+            for word in words:
+                postings = self._postings.get(word)
+                if postings is None:
+                    postings = self._postings[word] = set()
+                    for trigram in word_trigrams(word):
+                        self._trigrams.setdefault(trigram, set()).add(word)
+                postings.add(doc_id)
+            self._results.clear()
+
+    def remove(self, doc_id: int) -> None:
+        """Remove a document from the index."""
+        with self._lock:
+            self._remove(doc_id)
+            self._results.clear()
+
+    def _remove(self, doc_id: int) -> None:
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for word in doc[3]:
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.discard(doc_id)
+            if not postings:
+                # Last document with this word, forget the word
+                del self._postings[word]
+                for trigram in word_trigrams(word):
+                    words = self._trigrams.get(trigram)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self._trigrams[trigram]
+
+    def _candidate_words(self, query_word: str) -> Dict[str, float]:
+        """Return {indexed word: match weight} for one query word."""
+        candidates = {}
+
+        # Words starting with the query word: they contain all of its prefix trigrams
+        posting_lists = [self._trigrams.get(trigram, set()) for trigram in prefix_trigrams(query_word)]
+        if all(posting_lists):
+            for word in set.intersection(*sorted(posting_lists, key=len)):
+                if word.startswith(query_word):
+                    candidates[word] = EXACT_WEIGHT if word == query_word else PREFIX_WEIGHT
+
+        # Similar words, counted by shared trigrams
+        if len(query_word) >= MIN_FUZZY_LENGTH:
+            query_trigrams = word_trigrams(query_word)
+            shared = {}
+            for trigram in query_trigrams:
+                for word in self._trigrams.get(trigram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            for word, count in shared.items():
+                if word in candidates:
+                    continue
+                # A word has one trigram more than it has characters
+                similarity = count / (len(query_trigrams) + len(word) + 1 - count)
+                if similarity >= MIN_SIMILARITY:
+                    candidates[word] = FUZZY_WEIGHT * similarity
+
+        return candidates
+
+    def _rank(self, backend: str, query_words: Tuple[str, ...]) -> List[int]:
+        scores = {}  # doc id -> [matched query words, score]
+        for query_word in query_words:
+            best = {}  # doc id -> best weight for this query word
+            for word, weight in self._candidate_words(query_word).items():
+                for doc_id in self._postings.get(word, ()):
+                    doc = self._docs[doc_id]
+                    if doc[0] != backend:
+                        continue
+                    weighted = weight * doc[3][word]
+                    if weighted > best.get(doc_id, 0.0):
+                        best[doc_id] = weighted
+            for doc_id, weight in best.items():
+                entry = scores.setdefault(doc_id, [0, 0.0])
+                entry[0] += 1
+                entry[1] += weight
+
+        if not scores:
+            return []
+
+        # Documents matching every query word hide partial matches
+        most_matched = max(matched for matched, _ in scores.values())
+        phrase = ' '.join(query_words)
+        ranked = []
+        for doc_id, (matched, score) in scores.items():
+            if matched < most_matched:
+                continue
+            if len(query_words) > 1 and phrase in self._docs[doc_id][2]:
+                score += 1.0
+            ranked.append((-score, self._docs[doc_id][1], doc_id))
+        ranked.sort()
+        return [doc_id for _, _, doc_id in ranked]
+
+    def search(self, backend: str, query: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[int], int]:
+        """
+        Return one page of the ids of the best matching documents of a backend,
+        best first, and the total number of matches.
+        """
+        query_words = tuple(dict.fromkeys(tokenize(query)))
+        if not query_words:
+            return [], 0
+
+        key = (backend, query_words)
+        with self._lock:
+            ranked = self._results.get(key)
+            if ranked is None:
+                ranked = self._rank(backend, query_words)
+                self._results[key] = ranked
+                while len(self._results) > self.CACHED_QUERIES:
+                    self._results.popitem(last=False)
+            else:
+                self._results.move_to_end(key)
+
+        end = None if limit is None else offset + limit
+        return ranked[offset:end], len(ranked)
+
+    def build(self, documents: Iterable[Tuple[int, str, str, Optional[str], Optional[str]]]) -> None:
+        """Index (id, backend, name, title, uploader) documents, e.g. all rows of the media index."""
+        for doc_id, backend, name, title, uploader in documents:
+            self.add(doc_id, backend, name, title, uploader)
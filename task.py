@@ -13,20 +13,39 @@ from hurry.filesize import size
 import telegram
 from dotenv import load_dotenv
 import time
+import shutil
+import hashlib
+import threading
 from backends.upload_progress import upload_progress_manager
 from backends.storage_monitor import get_storage_monitor
+from backends.storage_manager import STAGING_DIR_NAME
+from job_store import get_job_store, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+from metadata_cache import get_metadata_cache, download_target
+from download_registry import inflight_registry
+from message_scheduler import get_message_scheduler
+from bot_client import get_bot
+from media_index import get_media_index
+from backends.remote_listing import get_remote_listing
+from download_queue import get_download_queue
+from download_batch import DownloadBatch
+from transcoder import get_transcoder, TranscodeJob
+from format_planner import plan_format, plan_conversion, MP3_FFMPEG_ARGS
+from download_options import get_download_options
+from bandwidth import get_bandwidth_manager
 
 # Global download counter for session IDs
 download_counter = 0
 
-# Session counter for unique progress tracking
+# Session counter for unique progress tracking, shared by all download workers
 session_counter = 0
+session_counter_lock = threading.Lock()
 
 def get_next_session_id():
     """Generate incremental session ID for downloads"""
     global session_counter
-    session_counter += 1
-    return f"[{session_counter:03d}]"
+    with session_counter_lock:
+        session_counter += 1
+        return f"[{session_counter:03d}]"
 
 CALLBACK_MP4 = "mp4"
 CALLBACK_MP3 = "mp3"
@@ -44,8 +63,35 @@ logger = logging.getLogger(__name__)
 load_dotenv(dotenv_path='./bot.env')
 BOT_TOKEN = os.getenv('BOT_TOKEN', None)
 
+# Items of a playlist or channel queued at most, the rest are skipped
+MAX_PLAYLIST_ITEMS = int(os.getenv('MAX_PLAYLIST_ITEMS', '100'))
+
+# Interrupted downloads are retried with exponential backoff, resuming their partial files
+DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES') or 3)
+DOWNLOAD_RETRY_DELAY = float(os.getenv('DOWNLOAD_RETRY_DELAY') or 10)
+MAX_RETRY_DELAY = 300
+# Parts of yt-dlp errors that no retry will fix
+PERMANENT_ERRORS = (
+    'video unavailable', 'private video', 'age-restricted', 'sign in', 'copyright', 'blocked',
+    'unsupported url', 'no video formats', 'requested format is not available', 'is empty'
+)
+
+def is_retryable(error):
+    """Whether a download failing with error may succeed when it is tried again."""
+    error = str(error).lower()
+    return not any(marker in error for marker in PERMANENT_ERRORS)
+
+def staging_name(dedup_key):
+    """
+    Name of the staging directory of a download. It is the same for every attempt
+    at the same download, so a retry, a restart or a repeated request continues
+    the partial files of the previous attempt.
+    """
+    return 'job-' + hashlib.sha1(repr(dedup_key).encode()).hexdigest()[:16]
+
 class TaskData:
-    def __init__(self, url, storage, selected_format, update, output_format='mp3', storage_manager=None, original_message_id=None) -> None:
+    def __init__(self, url, storage, selected_format, update, output_format='mp3', storage_manager=None, original_message_id=None,
+                 chat_id=None, progress_message_id=None, job_id=None) -> None:
         self.url = url
         self.storage = storage
         self.selected_format = selected_format
@@ -53,13 +99,32 @@ class TaskData:
         self.output_format = output_format
         self.storage_manager = storage_manager
         self.original_message_id = original_message_id
+        # Used instead of update when a job is restored from the job store
+        self.chat_id = chat_id
+        self.progress_message_id = progress_message_id
+        # Id of the persistent job record, see job_store.py
+        self.job_id = job_id
         
 class DownloadTask:
-    def __init__(self, taskData) -> None:
+    def __init__(self, taskData, bot=None, batch=None, title=None) -> None:
         self.data = taskData
+        # Batch message this task reports to instead of its own messages, see download_batch.py
+        self.batch = batch
+        self.title = title or self.data.url
+        self.expanded = False
+        # Set while the download is converted by the transcoder, which then finishes the task
+        self.transcoding = False
+        # Failed attempts so far, and whether the task waits to be queued again, see _schedule_retry()
+        self.attempts = 0
+        self.retrying = False
+        self.retry_delay = 0
         
         # Handle both callback queries and direct messages
-        if hasattr(self.data.update, 'callback_query') and self.data.update.callback_query:
+        if self.data.update is None:
+            # Restored from the job store, there is no update to answer
+            self.chat_id = self.data.chat_id
+            self.old_message_id = None
+        elif hasattr(self.data.update, 'callback_query') and self.data.update.callback_query:
             # From callback query (button click)
             self.chat_id = self.data.update.callback_query.message.chat.id
             self.old_message_id = self.data.update.callback_query.message.message_id
@@ -71,10 +136,168 @@ class DownloadTask:
         # Use original message ID from TaskData if available
         self.original_user_message_id = self.data.original_message_id
             
-        self.bot = telegram.Bot(BOT_TOKEN)
-        self.progress_message_id = None
+        # Shared bot client, see bot_client.py
+        self.bot = bot or get_bot()
+        self.progress_message_id = self.data.progress_message_id
         self.pbar = None
         self.upload_tracker = None
+        self.error = None
+        self.staging_dir = None
+        self.media_title = None
+        self.media_uploader = None
+        
+        # Set once the "queued" message has been sent, see announce_queued()
+        self.announced = threading.Event()
+        
+        # Download target used to detect duplicate requests, see download_registry.py;
+        # playlist URLs are keyed by their list, so they never match a single video
+        self.dedup_key = (download_target(self.data.url), self.data.selected_format,
+                          self.data.output_format, self.data.storage)
+        # [chat_id, message_id] of requests attached to this download, message_id is None
+        # while their message is being sent, see attach_follower()
+        self.followers = []
+        self.last_text = "🔄 Starting download..."
+        self.last_kwargs = {}
+        self.finished = False
+        # Items of batches waiting for this download instead of downloading it again
+        self.batch_followers = []
+        self._followers_lock = threading.Lock()
+
+    def attach_follower(self, chat_id):
+        """
+        Record another chat following this download. Called by the in-flight registry
+        under its lock; the message of the follower is sent by announce_follower().
+        """
+        follower = [chat_id, None]
+        with self._followers_lock:
+            self.followers.append(follower)
+        return follower
+
+    def add_batch_follower(self, item):
+        """
+        Let a batch item for the same target follow this download; it is counted
+        in its batch once this task ends. Called by the in-flight registry under its lock.
+        """
+        with self._followers_lock:
+            self.batch_followers.append(item)
+
+    def announce_follower(self, follower):
+        """
+        Send the message of an attached chat, mirroring the progress of this task.
+        A follower attached just before the task finished gets its final text.
+        """
+        chat_id = follower[0]
+        with self._followers_lock:
+            text, kwargs, finished = self.last_text, self.last_kwargs, self.finished
+        message_text = text if finished else f"🔗 Same download already in progress, following it...\n\n{text}"
+        try:
+            message = get_message_scheduler().call(chat_id, self.bot.send_message, chat_id, message_text, **kwargs)
+        except Exception as e:
+            logger.warning(f"Could not attach follower {chat_id}: {e}")
+            with self._followers_lock:
+                self.followers.remove(follower)
+            return
+
+        with self._followers_lock:
+            follower[1] = message.message_id
+            latest, latest_kwargs = self.last_text, self.last_kwargs
+        if latest != text:
+            # The task went on while the message was being sent
+            get_message_scheduler().edit(self.bot, chat_id, message.message_id, latest, **latest_kwargs)
+
+    def _edit_followers(self, text, **kwargs):
+        """Mirror text to the messages of all attached requests and to the batch message."""
+        with self._followers_lock:
+            self.last_text = text
+            self.last_kwargs = kwargs
+            followers = [(chat_id, message_id) for chat_id, message_id in self.followers if message_id]
+            batch_followers = list(self.batch_followers)
+        for chat_id, message_id in followers:
+            get_message_scheduler().edit(self.bot, chat_id, message_id, text, **kwargs)
+        if self.batch:
+            self.batch.item_progress(self, text)
+        for item in batch_followers:
+            item.batch.item_progress(item, text)
+
+    def _edit_progress(self, text, **kwargs):
+        """Update the progress message and the messages of attached requests."""
+        get_message_scheduler().edit(self.bot, self.chat_id, self.progress_message_id, text, **kwargs)
+        self._edit_followers(text, **kwargs)
+
+    def _on_uploaded(self, filename, file_path, file_size):
+        """Record a finished upload of the downloaded file."""
+        get_job_store().mark_uploaded(self.data.storage, file_path)
+        # The sync service announces the upload as well, this adds the source URL
+        get_remote_listing().add_uploaded_file(self.data.storage, filename, file_size, self.data.url,
+                                               self.media_title, self.media_uploader)
+
+    def announce_queued(self, position):
+        """
+        Send the initial progress message for a queued task.
+        The worker waits for this before it starts downloading so that
+        the queue message never overwrites download progress.
+        """
+        if self.batch:
+            # Shown in the batch message
+            self.announced.set()
+            return
+        try:
+            if position > 0:
+                text = f"⏳ Queued at position {position}..."
+            else:
+                text = "🔄 Starting download..."
+            if self.progress_message_id:
+                # Job restored after a restart, reuse its progress message
+                get_message_scheduler().edit(self.bot, self.chat_id, self.progress_message_id,
+                                             f"🔁 Resumed after restart\n{text}")
+            else:
+                progress_msg = get_message_scheduler().call(self.chat_id, self.bot.send_message, self.chat_id, text)
+                self.progress_message_id = progress_msg.message_id
+                if self.data.job_id:
+                    get_job_store().set_progress_message(self.data.job_id, self.progress_message_id)
+        except Exception as e:
+            logger.warning(f"Could not send queue message: {e}")
+        finally:
+            self.announced.set()
+
+    def run(self):
+        """Entry point for download queue workers."""
+        self.announced.wait(timeout=30)
+        self.retrying = False
+        if self.data.job_id:
+            get_job_store().update_status(self.data.job_id, STATUS_RUNNING)
+        if self.batch:
+            self.batch.item_started(self, self.title)
+
+        try:
+            self.downloadVideo()
+        finally:
+            if self.retrying:
+                timer = threading.Timer(self.retry_delay, get_download_queue().submit,
+                                        args=(self,), kwargs={'force': True})
+                timer.daemon = True
+                timer.start()
+            elif not self.transcoding:
+                self._finish()
+
+    def _finish(self):
+        """Release the task once it is over, after the download or after its conversion."""
+        with self._followers_lock:
+            self.finished = True
+        inflight_registry.release(self.dedup_key, self)
+        if self.batch and not self.expanded:
+            self.batch.item_finished(self, self.title, self.error)
+        # No more batch items can attach once the task is released
+        with self._followers_lock:
+            batch_followers = list(self.batch_followers)
+        for item in batch_followers:
+            item.batch.item_finished(item, item.title, self.error)
+
+        if self.data.job_id:
+            if self.error:
+                get_job_store().update_status(self.data.job_id, STATUS_FAILED, self.error)
+            else:
+                get_job_store().update_status(self.data.job_id, STATUS_DONE)
 
     def downloadVideo(self):
         """
@@ -84,53 +307,64 @@ class DownloadTask:
         try:
             # Send progress message with unique session identifier
             session_id = get_next_session_id()
-            progress_msg = self.bot.send_message(self.chat_id, f"🔄 Starting download... {session_id}")
-            self.progress_message_id = progress_msg.message_id
+            if self.progress_message_id:
+                # Reuse the message sent when the task was queued
+                self._edit_progress(f"🔄 Starting download... {session_id}")
+            elif self.batch is None:
+                # Items of a batch are shown in the batch message
+                progress_msg = get_message_scheduler().call(
+                    self.chat_id, self.bot.send_message, self.chat_id, f"🔄 Starting download... {session_id}"
+                )
+                self.progress_message_id = progress_msg.message_id
             
             # Initialize progress bar
-            self.pbar = CustomProgressTracker(self.bot, self.chat_id, self.progress_message_id)
+            self.pbar = CustomProgressTracker(self.bot, self.chat_id, self.progress_message_id,
+                                              on_update=self._edit_followers)
 
             logger.info("All settings: %s", self.data)
             logger.info("Video URL to download: '%s'", self.data.url)
             logger.info("Output format: '%s'", self.data.output_format)
             logger.info("Storage backend: '%s'", self.data.storage)
             
-            # Always download to /tmp first, then move to correct backend directory
-            temp_download_dir = "/tmp"
+            # Extract the info first (cached, playlists only listed flat) to tell videos from playlists
+            info = get_metadata_cache().extract_info(self.data.url)
+            if info.get('_type') == 'playlist':
+                self._expand_playlist(info)
+                return
             
             # Get final storage path from storage manager
             if self.data.storage_manager:
                 final_storage_dir = self.data.storage_manager.ensure_storage_path(self.data.storage)
                 backend_name = self.data.storage_manager.get_backend_display_name(self.data.storage)
                 is_cloud_backend = self.data.storage_manager.is_cloud_backend(self.data.storage)
-                logger.info(f"Will download to {temp_download_dir} then move to: {backend_name} -> {final_storage_dir}")
             else:
                 # Fallback to environment variable for local storage
                 final_storage_dir = os.getenv('LOCAL_STORAGE_DIR', './data')
                 backend_name = "Local Storage"
                 is_cloud_backend = False
-                logger.info(f"Will download to {temp_download_dir} then move to: {final_storage_dir}")
+            
+            # Download into a staging directory inside the backend directory, so moving
+            # the finished file into place is a rename on the same filesystem
+            self.staging_dir = os.path.join(final_storage_dir, STAGING_DIR_NAME, staging_name(self.dedup_key))
+            os.makedirs(self.staging_dir, exist_ok=True)
+            temp_download_dir = self.staging_dir
+            logger.info(f"Will download to {temp_download_dir} then move to: {backend_name} -> {final_storage_dir}")
             
             # Check storage space for cloud backends before download
             if is_cloud_backend:
-                storage_monitor = get_storage_monitor(BOT_TOKEN)
-                
-                # Update progress message to show storage check
-                self.bot.edit_message_text(f"🔍 Checking {backend_name} storage space...", self.chat_id, self.progress_message_id)
+                storage_monitor = get_storage_monitor(self.bot)
                 
-                # Check storage and send notification if needed
-                storage_ok = storage_monitor.check_and_notify(self.data.storage, self.chat_id)
+                # Check cached quota and send notification if needed, never waits for rclone
+                storage_ok = storage_monitor.check_and_notify(self.data.storage, self.chat_id, blocking=False)
                 
                 if not storage_ok:
                     # Storage is low, but continue with download (user has been warned)
                     logger.warning(f"Storage low for {self.data.storage}, but continuing with download")
                     
                     # Update message to show warning but continuing
-                    self.bot.edit_message_text(
+                    self._edit_progress(
                         f"⚠️ {backend_name} storage is low, but continuing download...\n"
-                        f"🔄 Starting download... {session_id}", 
-                        self.chat_id, 
-                        self.progress_message_id
+                        f"🔄 Starting download... {session_id}"
                     )
                     time.sleep(2)  # Give user time to read the warning
                 else:
@@ -138,10 +372,10 @@ class DownloadTask:
             
             # Check local filesystem space for local backend
             elif self.data.storage == 'local':
-                storage_monitor = get_storage_monitor(BOT_TOKEN)
+                storage_monitor = get_storage_monitor(self.bot)
                 
                 # Update progress message to show storage check
-                self.bot.edit_message_text(f"🔍 Checking local filesystem space...", self.chat_id, self.progress_message_id)
+                self._edit_progress(f"🔍 Checking local filesystem space...")
                 
                 # Check local filesystem and send notification if needed
                 storage_ok = storage_monitor.check_and_notify(self.data.storage, self.chat_id, final_storage_dir)
@@ -151,149 +385,66 @@ class DownloadTask:
                     logger.warning(f"Local filesystem space low, but continuing with download")
                     
                     # Update message to show warning but continuing
-                    self.bot.edit_message_text(
+                    self._edit_progress(
                         f"⚠️ Local filesystem space is low, but continuing download...\n"
-                        f"🔄 Starting download... {session_id}", 
-                        self.chat_id, 
-                        self.progress_message_id
+                        f"🔄 Starting download... {session_id}"
                     )
                     time.sleep(2)  # Give user time to read the warning
                 else:
                     logger.info(f"Local filesystem check passed")
             
-            # Configure yt-dlp options to download to /tmp
+            # Configure yt-dlp options to download to the staging directory
             YT_DLP_OPTIONS = {
-                'format': self.data.selected_format,
+                # Audio outputs only download an audio stream, see format_planner.py
+                'format': plan_format(self.data.selected_format, self.data.output_format),
                 'restrictfilenames': True,
-                'outtmpl': f'{temp_download_dir}/%(title)s.%(ext)s',  # Download to /tmp
-                'progress_hooks': [self.my_hook]
+                'outtmpl': f'{temp_download_dir}/%(title)s.%(ext)s',  # Download to staging
+                'progress_hooks': [self.my_hook],
+                # Continue .part files left in the staging directory by an earlier attempt
+                'continuedl': True,
+                # Parallel fragments, chunked HTTP and external downloader, see download_options.py
+                **get_download_options()
             }
             
-            # Only add post-processors for MP3 (audio extraction)
-            if self.data.output_format == 'mp3':
-                YT_DLP_OPTIONS['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
-            # For MP4, we keep the video as-is (no post-processing needed)
-
+            # Share of the download bandwidth, enforced in my_hook, see bandwidth.py
+            bandwidth = get_bandwidth_manager()
+            bandwidth.register(self, self.chat_id)
+            if 'external_downloader' in YT_DLP_OPTIONS:
+                # External downloaders do not report progress while running, they get their share at start
+                YT_DLP_OPTIONS['ratelimit'] = bandwidth.get_rate(self)
+            
+            # Audio is converted or remuxed by the transcoder after the download, videos are kept as-is
             with yt_dlp.YoutubeDL(YT_DLP_OPTIONS) as ydl:
-                result = ydl.extract_info("{}".format(self.data.url))
+                result = ydl.process_ie_result(info, download=True)
                 original_video_name = ydl.prepare_filename(result)
             
+            # Searchable metadata for the media index
+            self.media_title = result.get('title')
+            self.media_uploader = result.get('uploader')
+            
             # Cleanup progress bar after download completes
             if self.pbar:
                 self.pbar.close()
                 self.pbar = None
 
-            # Determine the final file name based on output format
             temp_file_path = original_video_name.replace('/home/bot/', './')
-            raw_media_name = os.path.splitext(temp_file_path)[0]
-            
-            if self.data.output_format == 'mp3':
-                temp_file_path = f"{raw_media_name}.mp3"
-            else:  # mp4 or keep original format
-                # For MP4, the file might already have the correct extension from yt-dlp
-                pass  # temp_file_path is already correct
-            
             logger.info(f"File downloaded to temp location: {temp_file_path}")
-
-            # Update message to show moving to final storage
-            self.bot.edit_message_text(f"💾 Moving file to {backend_name}...", self.chat_id, self.progress_message_id)
-
-            try:
-                # Move file from /tmp to final storage directory
-                filename = os.path.basename(temp_file_path)
-                final_file_path = os.path.join(final_storage_dir, filename)
-                
-                # Ensure final directory exists
-                os.makedirs(final_storage_dir, exist_ok=True)
-                
-                # Move file to final location
-                import shutil
-                shutil.move(temp_file_path, final_file_path)
-                logger.info(f"File moved from {temp_file_path} to {final_file_path}")
-                
-                # Start upload progress monitoring for cloud backends
-                if is_cloud_backend:
-                    logger.info(f"Starting upload progress monitoring for cloud backend: {self.data.storage}")
-                    self.upload_tracker = upload_progress_manager.start_upload_monitoring(
-                        bot=self.bot,
-                        chat_id=self.chat_id,
-                        message_id=self.progress_message_id,
-                        backend=self.data.storage,
-                        filename=filename,
-                        timeout=300,  # 5 minutes timeout
-                        # Pass additional info for final message
-                        original_user_message_id=self.original_user_message_id,
-                        file_path=final_file_path,
-                        output_format=self.data.output_format,
-                        url=self.data.url,
-                        backend_name=backend_name
-                    )
-                    
-                    # Wait a bit for upload to potentially complete
-                    # The upload tracker will update the message automatically
-                    time.sleep(2)
-                    
-                    # Check if upload completed quickly (small files)
-                    if self.upload_tracker and not self.upload_tracker.upload_completed:
-                        # For larger files, the upload tracker will continue monitoring
-                        # and update the message when upload completes
-                        logger.info(f"Upload monitoring active for {filename}")
-                        return  # Let the upload tracker handle the final message
-                
-                # Determine cloud sync info
-                cloud_info = ""
-                if is_cloud_backend:
-                    if self.upload_tracker and self.upload_tracker.upload_completed:
-                        cloud_info = f"\n✅ Uploaded to {self.data.storage} successfully"
-                    else:
-                        cloud_info = f"\n☁️ Upload to {self.data.storage} in progress..."
-                elif self.data.storage != 'local':
-                    cloud_info = f"\n☁️ Cloud sync: Will be synced to {self.data.storage} automatically"
-                
-                # Final success message with backend info
-                self.bot.edit_message_text(
-                    f"✅ Download completed!\n\n"
-                    f"📁 File: {filename}\n"
-                    f"🎵 Format: {self.data.output_format.upper()}\n"
-                    f"💾 Backend: {backend_name}\n"
-                    f"📂 Location: {final_storage_dir}/"
-                    f"{cloud_info}\n"
-                    f"🔗 URL: {self.data.url[:50]}...", 
-                    self.chat_id, 
-                    self.progress_message_id,
-                    disable_web_page_preview=True
-                )
-                
-                # Delete the original user message with the YouTube URL
-                if self.original_user_message_id and self.original_user_message_id != self.progress_message_id:
-                    try:
-                        self.bot.delete_message(self.chat_id, self.original_user_message_id)
-                        logger.info(f"Deleted original user message: {self.original_user_message_id}")
-                    except Exception as e:
-                        logger.warning(f"Could not delete original user message: {e}")
-            except Exception as e:
-                logger.error(f"Error moving file to final storage: {e}")
-                self.bot.edit_message_text(
-                    f"❌ Error moving file to {backend_name}\n"
-                    f"Temp file: {temp_file_path}\n"
-                    f"Error: {str(e)[:100]}", 
-                    self.chat_id, 
-                    self.progress_message_id
-                )
             
-            # Delete the original message after processing (if it exists and is different)
-            if hasattr(self, 'old_message_id') and self.old_message_id != self.progress_message_id:
-                try:
-                    self.bot.delete_message(self.chat_id, self.old_message_id)
-                except Exception as e:
-                    logger.warning(f"Could not delete original message: {e}")
-                    
+            conversion = plan_conversion(temp_file_path, self.data.output_format, result.get('acodec'))
+            if conversion:
+                # Conversion runs in the transcoder pool, this download worker moves on
+                output_path, ffmpeg_args = conversion
+                self._convert(temp_file_path, output_path, ffmpeg_args, result.get('duration'),
+                              final_storage_dir, backend_name, is_cloud_backend)
+                return
+            
+            self._store_file(temp_file_path, final_storage_dir, backend_name, is_cloud_backend)
         except yt_dlp.utils.DownloadError as e:
+            if is_retryable(e) and self.attempts < DOWNLOAD_RETRIES:
+                self._schedule_retry(e)
+                return
             logger.error(f"yt-dlp Download failed: {e}")
+            self.error = str(e)
             if self.progress_message_id:
                 # Interpret yt-dlp errors intelligently
                 error_str = str(e).lower()
@@ -308,26 +459,254 @@ class DownloadTask:
                 elif 'unsupported url' in error_str or 'no video formats' in error_str:
                     error_msg = "❌ Unsupported URL!\n\nThis platform or URL format is not supported by yt-dlp."
                 elif 'network' in error_str or 'connection' in error_str:
-                    error_msg = "❌ Network error!\n\nCannot connect to the video source. Please try again later."
+                    error_msg = ("❌ Network error!\n\nCannot connect to the video source. Please try again later, "
+                                 "the download continues where it stopped.")
                 else:
                     error_msg = f"❌ Download failed!\n\n{str(e)[:150]}..."
                 
-                self.bot.edit_message_text(error_msg, self.chat_id, self.progress_message_id)
+                self._edit_progress(error_msg)
         except Exception as e:
             logger.error(f"Download failed: {e}")
+            self.error = str(e)
             if self.progress_message_id:
-                self.bot.edit_message_text(f"❌ Unexpected error!\n\n{str(e)[:100]}...", self.chat_id, self.progress_message_id)
+                self._edit_progress(f"❌ Unexpected error!\n\n{str(e)[:100]}...")
         finally:
+            # Hand the bandwidth share of this download to the others
+            get_bandwidth_manager().unregister(self)
             # Ensure progress bar is cleaned up
             if self.pbar:
                 self.pbar.close()
                 self.pbar = None
+            # Remove the staging directory including partial downloads,
+            # a file handed to the transcoder is cleaned up once it is converted
+            if self.staging_dir and not self.transcoding:
+                if self.retrying or (self.error and is_retryable(self.error)):
+                    # Kept for the next attempt, abandoned ones are removed by the storage manager
+                    logger.info(f"Keeping partial download in {self.staging_dir}")
+                else:
+                    shutil.rmtree(self.staging_dir, ignore_errors=True)
+                self.staging_dir = None
+
+    def _schedule_retry(self, error):
+        """
+        Put the task back on the download queue after an exponential backoff.
+        The worker goes on with other downloads meanwhile; the next attempt
+        continues the .part files in the staging directory.
+        """
+        self.attempts += 1
+        delay = min(MAX_RETRY_DELAY, DOWNLOAD_RETRY_DELAY * 2 ** (self.attempts - 1))
+        logger.warning(f"Download of {self.data.url} interrupted, retry {self.attempts}/{DOWNLOAD_RETRIES} "
+                       f"in {delay:.0f}s: {error}")
+        self._edit_progress(f"⚠️ Download interrupted, resuming in {delay:.0f}s "
+                            f"(retry {self.attempts}/{DOWNLOAD_RETRIES})...")
+        # Queued again once run() returned, from here on the retry finishes the task
+        self.retrying = True
+        self.retry_delay = delay
+
+    def _store_file(self, temp_file_path, final_storage_dir, backend_name, is_cloud_backend):
+        """
+        Move a finished file from the staging directory into the backend directory,
+        index it or start monitoring its upload, and report the result.
+        """
+        # Update message to show moving to final storage
+        self._edit_progress(f"💾 Moving file to {backend_name}...")
+
+        try:
+            # Move file from staging to final storage directory
+            filename = os.path.basename(temp_file_path)
+            final_file_path = os.path.join(final_storage_dir, filename)
+            
+            # Atomic rename, staging and backend directory share a filesystem
+            os.replace(temp_file_path, final_file_path)
+            logger.info(f"File moved from {temp_file_path} to {final_file_path}")
+            
+            # Remember the result so repeated requests complete instantly
+            get_job_store().record_stored_file(*self.dedup_key, final_file_path)
+            
+            if not is_cloud_backend:
+                # Make the file show up in /ls and /search right away
+                try:
+                    get_media_index().upsert_file(self.data.storage, final_file_path, self.data.url,
+                                                  self.media_title, self.media_uploader)
+                except Exception as e:
+                    logger.warning(f"Could not add {final_file_path} to media index: {e}")
+            
+            if is_cloud_backend:
+                # Keep the cached cloud quota current without asking rclone again
+                file_size = os.path.getsize(final_file_path)
+                get_storage_monitor(self.bot).record_usage(self.data.storage, file_size)
+            
+            # Start upload progress monitoring for cloud backends; items of a batch have no
+            # progress message, their tracker only records the finished upload
+            if is_cloud_backend:
+                logger.info(f"Starting upload progress monitoring for cloud backend: {self.data.storage}")
+                self.upload_tracker = upload_progress_manager.start_upload_monitoring(
+                    bot=self.bot,
+                    chat_id=self.chat_id,
+                    message_id=None if self.batch else self.progress_message_id,
+                    backend=self.data.storage,
+                    filename=filename,
+                    timeout=300,  # 5 minutes timeout
+                    # Pass additional info for final message
+                    original_user_message_id=self.original_user_message_id,
+                    file_path=final_file_path,
+                    output_format=self.data.output_format,
+                    url=self.data.url,
+                    backend_name=backend_name,
+                    on_success=lambda: self._on_uploaded(filename, final_file_path, file_size),
+                    # Attached requests follow the upload up to its final message
+                    on_message=self._edit_followers
+                )
+                
+                # The upload tracker updates the message on its own, no need to wait for it;
+                # this may run on a transcoder worker, which would be blocked meanwhile
+                if self.upload_tracker and not self.upload_tracker.upload_completed:
+                    # For larger files, the upload tracker will continue monitoring
+                    # and update the message when upload completes
+                    logger.info(f"Upload monitoring active for {filename}")
+                    self._edit_followers(
+                        f"✅ Download completed!\n\n"
+                        f"📁 File: {filename}\n"
+                        f"💾 Backend: {backend_name}\n"
+                        f"☁️ Upload to {self.data.storage} in progress...",
+                        disable_web_page_preview=True
+                    )
+                    return  # Let the upload tracker handle the final message
+            
+            # Determine cloud sync info
+            cloud_info = ""
+            if is_cloud_backend:
+                if self.upload_tracker and self.upload_tracker.upload_completed:
+                    cloud_info = f"\n✅ Uploaded to {self.data.storage} successfully"
+                else:
+                    cloud_info = f"\n☁️ Upload to {self.data.storage} in progress..."
+            elif self.data.storage != 'local':
+                cloud_info = f"\n☁️ Cloud sync: Will be synced to {self.data.storage} automatically"
+            
+            # Final success message with backend info
+            self._edit_progress(
+                f"✅ Download completed!\n\n"
+                f"📁 File: {filename}\n"
+                f"🎵 Format: {self.data.output_format.upper()}\n"
+                f"💾 Backend: {backend_name}\n"
+                f"📂 Location: {final_storage_dir}/"
+                f"{cloud_info}\n"
+                f"🔗 URL: {self.data.url[:50]}...",
+                disable_web_page_preview=True
+            )
+            
+            # Delete the original user message with the YouTube URL
+            if self.original_user_message_id and self.original_user_message_id != self.progress_message_id:
+                try:
+                    get_message_scheduler().call(self.chat_id, self.bot.delete_message,
+                                                 self.chat_id, self.original_user_message_id)
+                    logger.info(f"Deleted original user message: {self.original_user_message_id}")
+                except Exception as e:
+                    logger.warning(f"Could not delete original user message: {e}")
+        except Exception as e:
+            logger.error(f"Error moving file to final storage: {e}")
+            self.error = str(e)
+            # Keep the downloaded file, the error message points to it
+            self.staging_dir = None
+            self._edit_progress(
+                f"❌ Error moving file to {backend_name}\n"
+                f"Temp file: {temp_file_path}\n"
+                f"Error: {str(e)[:100]}"
+            )
+        
+        # Delete the original message after processing (if it exists and is different)
+        if self.old_message_id and self.old_message_id != self.progress_message_id:
+            try:
+                get_message_scheduler().call(self.chat_id, self.bot.delete_message,
+                                             self.chat_id, self.old_message_id)
+            except Exception as e:
+                logger.warning(f"Could not delete original message: {e}")
+
+    def _convert(self, input_path, output_path, ffmpeg_args, duration, final_storage_dir, backend_name,
+                 is_cloud_backend):
+        """
+        Hand the conversion of a downloaded file to the transcoder pool.
+        Once it is converted the output is stored and the task finished on the transcoder thread.
+        """
+        if ffmpeg_args == MP3_FFMPEG_ARGS:
+            action = "🎛️ Converting to MP3"
+        else:
+            action = "📦 Extracting audio"
+        tracker = CustomProgressTracker(self.bot, self.chat_id, self.progress_message_id,
+                                        on_update=self._edit_followers, action=action)
+
+        def on_done(error):
+            try:
+                if error:
+                    self.error = error
+                    self._edit_progress(f"❌ Conversion failed!\n\n{error[:100]}")
+                else:
+                    self._store_file(output_path, final_storage_dir, backend_name, is_cloud_backend)
+            except Exception as e:
+                logger.error(f"Storing converted file failed: {e}")
+                self.error = str(e)
+                self._edit_progress(f"❌ Unexpected error!\n\n{str(e)[:100]}...")
+            finally:
+                if self.staging_dir:
+                    shutil.rmtree(self.staging_dir, ignore_errors=True)
+                    self.staging_dir = None
+                self._finish()
+
+        job = TranscodeJob(input_path, output_path, ffmpeg_args, duration,
+                           on_progress=tracker.update, on_done=on_done)
+        self._edit_progress("🎛️ Waiting for conversion...")
+        # From here on the transcoder finishes the task
+        self.transcoding = True
+        position = get_transcoder().submit(job)
+        if position > 0:
+            self._edit_progress(f"🎛️ Queued for conversion at position {position}...")
+
+    def _expand_playlist(self, info):
+        """
+        Queue the items of a playlist or channel as downloads of their own.
+        They run in parallel on the download queue and report to one batch
+        message, which replaces the progress message of this task.
+        """
+        entries = [entry for entry in info.get('entries') or []
+                   if entry and (entry.get('webpage_url') or entry.get('url'))]
+        if not entries:
+            raise yt_dlp.utils.DownloadError("This playlist is empty")
+        
+        queued = self.batch.total if self.batch else 0
+        items = entries[:max(0, MAX_PLAYLIST_ITEMS - queued)]
+        # Only the first MAX_PLAYLIST_ITEMS entries are listed, see metadata_cache.py
+        skipped = max(len(entries), info.get('playlist_count') or 0) - len(items)
+        title = info.get('title') or self.data.url
+        
+        self.expanded = True
+        if self.batch:
+            # A playlist inside a playlist, e.g. the tabs of a channel
+            batch = self.batch
+            batch.item_expanded(self, len(items), skipped)
+        else:
+            batch = DownloadBatch(self.bot, self.chat_id, self.progress_message_id,
+                                  f"Playlist: {title}", len(items), skipped)
+            batch.refresh()
+        logger.info(f"Expanding playlist '{title}' into {len(items)} downloads ({skipped} skipped)")
+        
+        queue_batch_items(batch, [(entry.get('webpage_url') or entry.get('url'), entry.get('title'))
+                                  for entry in items], self.data, self.chat_id, self.bot)
+        
+        # Remove the menu message the download was started from
+        if self.old_message_id and self.old_message_id != self.progress_message_id:
+            try:
+                get_message_scheduler().call(self.chat_id, self.bot.delete_message,
+                                             self.chat_id, self.old_message_id)
+            except Exception as e:
+                logger.warning(f"Could not delete original message: {e}")
 
     def my_hook(self, d):
         """
         Progress hook for yt-dlp downloads.
         """
         if d['status'] == 'downloading':
+            # Waits while the download is ahead of its bandwidth share
+            get_bandwidth_manager().throttle(self, d.get('downloaded_bytes'), d.get('speed'), d.get('filename'))
             if self.pbar:
                 try:
                     # Extract progress information
@@ -349,11 +728,43 @@ class DownloadTask:
             if self.pbar:
                 self.pbar.update(100)
 
+def queue_batch_items(batch, items, data, chat_id, bot):
+    """
+    Queue (url, title) items as downloads reporting to batch.
+    Storage backend and formats are taken from data; items that are already
+    stored are counted as done right away, items downloading for another
+    request follow that download.
+    """
+    job_store = get_job_store()
+    for url, title in items:
+        item_data = TaskData(url, data.storage, data.selected_format, None, data.output_format,
+                             data.storage_manager, chat_id=chat_id)
+        task = DownloadTask(item_data, bot, batch=batch, title=title)
+        
+        if job_store.find_stored_file(*task.dedup_key):
+            batch.item_finished(task, task.title)
+            continue
+        if inflight_registry.register_or_follow(task.dedup_key, task):
+            # Counted in the batch once the download it follows ends
+            continue
+        
+        item_data.job_id = job_store.create_job(
+            url, item_data.selected_format, item_data.output_format, item_data.storage, chat_id,
+            title=title, batch_message_id=batch.message_id, batch_title=batch.title
+        )
+        # Items of an accepted batch are never rejected by the queue limit
+        position = get_download_queue().submit(task, force=True)
+        task.announce_queued(position)
+
 class CustomProgressTracker:
-    def __init__(self, bot, chat_id, message_id):
+    def __init__(self, bot, chat_id, message_id, on_update=None, action="📥 Downloading"):
         self.bot = bot
         self.chat_id = chat_id
         self.message_id = message_id
+        # Optional callback receiving every progress text, e.g. to mirror it elsewhere
+        self.on_update = on_update
+        # Shown in front of the progress, e.g. "📥 Downloading... 42%"
+        self.action = action
         self.last_percent = 0
         self.last_update_time = 0
         self.total_size = None
@@ -363,17 +774,20 @@ class CustomProgressTracker:
         """Update progress with percentage and optional file size info"""
         current_time = time.time()
         
-        # Only update if percentage changed by at least 5% or 2 seconds passed
+        # Only update if percentage changed by at least 5% or 2 seconds passed,
+        # the message scheduler coalesces edits that are still faster than Telegram allows
         if abs(percent - self.last_percent) >= 5 or (current_time - self.last_update_time) >= 2:
             try:
                 if downloaded_bytes and total_bytes:
                     downloaded_mb = downloaded_bytes / (1024 * 1024)
                     total_mb = total_bytes / (1024 * 1024)
-                    progress_text = f"📥 Downloading... {percent:.0f}% ({downloaded_mb:.1f}/{total_mb:.1f}MB)"
+                    progress_text = f"{self.action}... {percent:.0f}% ({downloaded_mb:.1f}/{total_mb:.1f}MB)"
                 else:
-                    progress_text = f"📥 Downloading... {percent:.0f}%"
+                    progress_text = f"{self.action}... {percent:.0f}%"
                 
-                self.bot.edit_message_text(progress_text, self.chat_id, self.message_id)
+                get_message_scheduler().edit(self.bot, self.chat_id, self.message_id, progress_text)
+                if self.on_update:
+                    self.on_update(progress_text)
                 self.last_percent = percent
                 self.last_update_time = current_time
                 logger.info(f"Progress updated: {percent:.0f}%")
@@ -1,12 +1,12 @@
 from typing import Text
-import telegram
 from tqdm import tqdm
 from datetime import datetime
+from message_scheduler import get_message_scheduler
 
 
 class _TelegramIO():
-    def __init__(self, token, chat_id, message_id):
-        self.bot = telegram.Bot(token)
+    def __init__(self, bot, chat_id, message_id):
+        self.bot = bot
         self.chat_id = chat_id
         self.text = self.prev_text = '<< Init tg_tqdm bar >>'
         self.message_id = message_id
@@ -19,11 +19,11 @@ class _TelegramIO():
 
     def flush(self):
         if self.prev_text != self.text:
-            self.bot.edit_message_text(self.text , self.chat_id, self.message_id)
+            get_message_scheduler().edit(self.bot, self.chat_id, self.message_id, self.text)
             self.prev_text = self.text
             
 
-def tg_tqdm(token, chat_id, message_id,
+def tg_tqdm(bot, chat_id, message_id,
             desc=None, total=None, leave=True, ncols=None, mininterval=1.0, maxinterval=10.0,
             miniters=None, ascii=False, disable=False, unit='it',
             unit_scale=False, dynamic_ncols=False, smoothing=0.3,
@@ -39,8 +39,8 @@ def tg_tqdm(token, chat_id, message_id,
         iterable  : iterable, required
             Iterable to decorate with a progressbar.
             Leave blank to manually manage the updates.
-        token  : string, required
-            Token of your telegram bot
+        bot  : telegram.Bot, required
+            Bot client used to send the updates, e.g. bot_client.get_bot()
             
         chat_id  : int, required
             Chat ID where information will be sent about the progress
@@ -52,7 +52,7 @@ def tg_tqdm(token, chat_id, message_id,
             Like in tqdm
             
     """
-    tg_io = _TelegramIO(token, chat_id, message_id)
+    tg_io = _TelegramIO(bot, chat_id, message_id)
     return tqdm(desc=desc,
                 total=total,
                 leave=leave,
@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+import subprocess
+import logging
+from collections import deque
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TranscodeJob:
+    """
+    Conversion of one downloaded file with FFmpeg, see Transcoder.submit().
+
+    Args:
+        input_path: Downloaded file, removed once the conversion succeeded
+        output_path: File to write
+        ffmpeg_args: Output options, e.g. ['-vn', '-codec:a', 'libmp3lame', '-b:a', '192k']
+        duration: Length of the media in seconds, used to report progress
+        on_progress: Called with the conversion progress in percent
+        on_done: Called with None once the conversion succeeded or with an error message
+    """
+
+    def __init__(self, input_path: str, output_path: str, ffmpeg_args: List[str], duration: float = None,
+                 on_progress: Optional[Callable[[float], None]] = None,
+                 on_done: Optional[Callable[[Optional[str]], None]] = None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.ffmpeg_args = ffmpeg_args
+        self.duration = duration
+        self.on_progress = on_progress
+        self.on_done = on_done
+
+
+class Transcoder:
+    """
+    Runs FFmpeg conversions of finished downloads on a pool of worker threads,
+    each driving one ffmpeg process, so conversions use all cores while the
+    download workers go on with the next download.
+
+    Pending jobs wait in a bounded FIFO queue. submit() blocks while it is full,
+    which slows the download workers down to the pace conversions drain at
+    instead of piling up downloaded files.
+    """
+
+    def __init__(self, max_workers: int = None, max_pending: int = None, ffmpeg_path: str = 'ffmpeg'):
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.max_pending = max(1, max_pending or 2 * self.max_workers)
+        self.ffmpeg_path = ffmpeg_path
+
+        self._pending = deque()
+        self._active = 0
+        self._condition = threading.Condition()
+        self._workers = []
+        self._running = False
+
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Start the worker threads (idempotent)."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        for index in range(self.max_workers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"transcode-worker-{index + 1}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+        logger.info(f"Transcoder started with {self.max_workers} workers "
+                    f"and {self.max_pending} pending slots")
+
+    def stop(self) -> None:
+        """Stop accepting work and let the workers exit after their current job."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+    def submit(self, job: TranscodeJob) -> int:
+        """
+        Add a job to the queue, waiting while the queue is full.
+
+        Returns:
+            Position in the queue (0 if a worker is free and the job starts right away)
+        """
+        with self._condition:
+            while len(self._pending) >= self.max_pending:
+                self._condition.wait()
+
+            self._pending.append(job)
+            idle_workers = self.max_workers - self._active
+            position = max(0, len(self._pending) - idle_workers)
+            self._condition.notify_all()
+
+        logger.info(f"Queued conversion of {os.path.basename(job.input_path)} (position {position})")
+        return position
+
+    def stats(self) -> dict:
+        """Return a snapshot of the transcoder state."""
+        with self._condition:
+            return {
+                'active': self._active,
+                'pending': len(self._pending),
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                job = self._pending.popleft()
+                self._active += 1
+                # Wake up submitters waiting for a free slot
+                self._condition.notify_all()
+
+            error = None
+            try:
+                error = self._convert(job)
+            except Exception as e:
+                error = str(e)
+            finally:
+                with self._condition:
+                    self._active -= 1
+                    if error:
+                        self.failed += 1
+                    else:
+                        self.completed += 1
+
+            if job.on_done:
+                try:
+                    job.on_done(error)
+                except Exception as e:
+                    logger.error(f"Conversion callback crashed: {e}")
+
+    def _convert(self, job: TranscodeJob) -> Optional[str]:
+        """Run ffmpeg for a job. Returns None on success or an error message."""
+        started_at = time.time()
+        cmd = [
+            self.ffmpeg_path, '-y', '-nostdin', '-hide_banner', '-loglevel', 'error',
+            '-i', job.input_path,
+            *job.ffmpeg_args,
+            '-progress', 'pipe:1', '-nostats',
+            job.output_path
+        ]
+
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            return f"Could not start ffmpeg: {e}"
+
+        # -progress writes key=value lines, out_time_us is the position in the output
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key in ('out_time_us', 'out_time_ms') and job.duration and job.on_progress:
+                try:
+                    percent = min(100.0, int(value) / 1e6 / job.duration * 100)
+                except ValueError:
+                    continue
+                try:
+                    job.on_progress(percent)
+                except Exception as e:
+                    logger.warning(f"Error reporting conversion progress: {e}")
+
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            logger.error(f"ffmpeg failed for {job.input_path}: {stderr.strip()}")
+            try:
+                os.remove(job.output_path)
+            except OSError:
+                pass
+            return stderr.strip().splitlines()[-1] if stderr.strip() else f"ffmpeg exited with {process.returncode}"
+
+        if job.input_path != job.output_path:
+            try:
+                os.remove(job.input_path)
+            except OSError:
+                pass
+        logger.info(f"Converted {os.path.basename(job.input_path)} in {time.time() - started_at:.1f}s")
+        return None
+
+
+# Global transcoder instance
+transcoder = None
+
+def get_transcoder() -> Transcoder:
+    """Get or create the global transcoder, configured from the environment."""
+    global transcoder
+    if transcoder is None:
+        workers = int(os.getenv('TRANSCODE_WORKERS') or 0) or os.cpu_count() or 1
+        transcoder = Transcoder(
+            max_workers=workers,
+            max_pending=int(os.getenv('TRANSCODE_QUEUE_SIZE') or 0) or 2 * workers
+        )
+        transcoder.start()
+    return transcoder